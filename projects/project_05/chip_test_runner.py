@@ -0,0 +1,187 @@
+import os
+import re
+import sys
+import time
+import argparse
+import concurrent.futures
+from pathlib import Path
+
+import hdl_simulator
+from hdl_simulator import Library, TestScript, PROJECTS, HDL
+
+'''
+Runs every chip test of project_01 to project_05 on a pool of processes. Scripts are
+discovered as the .tst files whose compare-to file exists and which load an .hdl chip;
+the CPU emulator scripts of project_04, which load .hack programs, are left out. The
+scripts are grouped by chip, and each chip is one job, so the scripts of a chip share its
+netlist. Each worker process keeps one Library per directory, whose flattened parts are
+reused by every later chip that contains them.
+
+The dependency graph of every chip, the chips it is built from in HDL, orders the jobs
+so that the largest chips start first, and explains failures: a failing chip reports
+which of the chips it depends on fail as well.
+'''
+
+TST = '.tst'
+
+#the libraries of the current worker process, by directory
+LIBRARIES = {}
+
+def script_chip(path):
+    '''
+    Returns the chip a .tst script loads and the file it compares to, or None for either
+    '''
+    with open(path, 'r') as file:
+        text = hdl_simulator.strip_hdl_comments(file.read())
+    load = re.search(r'\bload\s+([\w.-]+)', text)
+    compare = re.search(r'\bcompare-to\s+([\w.-]+)', text)
+    chip = load.group(1) if load else None
+    if chip is None or not chip.endswith(HDL):
+        return None, None
+    return chip[:-len(HDL)], compare.group(1) if compare else None
+
+def discover(root=PROJECTS):
+    '''
+    Returns {(directory, chip) : [scripts]} for every chip test under the projects directory
+    '''
+    tests = {}
+    for path in sorted(Path(root).glob('project_0[1-5]/**/*' + TST)):
+        chip, compare = script_chip(path)
+        if chip is None or compare is None or not path.parent.joinpath(compare).is_file():
+            continue
+        tests.setdefault((path.parent, chip), []).append(path)
+    return tests
+
+def dependencies(library, name, graph=None):
+    '''
+    Returns {chip : set of chips it is built from} for name and every chip below it.
+    Builtins have no dependencies.
+    '''
+    graph = {} if graph is None else graph
+    if name in graph:
+        return graph
+    definition = library.lookup(name, under_test=not graph)
+    graph[name] = set() if isinstance(definition, type) else {part for part, _ in definition.parts}
+    for part in graph[name]:
+        dependencies(library, part, graph)
+    return graph
+
+def library(directory):
+    if directory not in LIBRARIES:
+        LIBRARIES[directory] = Library(directory)
+    return LIBRARIES[directory]
+
+def run_chip(directory, chip, scripts, press_keys=False):
+    '''
+    Runs the scripts of one chip for the process pool. Returns (chip, [(script, failure
+    message or None, seconds, keys pressed)], seconds) and never raises.
+    '''
+    start = time.perf_counter()
+    netlists = {}
+    results = []
+    for path in scripts:
+        begin = time.perf_counter()
+        pressed = []
+        try:
+            script = TestScript(path, library(directory), netlists, press_keys)
+            pressed = script.pressed
+            script.run()
+            failure = script.compare()
+        except Exception as error:
+            #broken HDL can fail in any way, and must fail only its own script
+            failure = '{kind}: {error}'.format(kind=type(error).__name__, error=error)
+        results.append((path, failure, time.perf_counter() - begin, pressed))
+    return chip, results, time.perf_counter() - start
+
+def parse_args(args):
+    usage = 'Runs the chip tests of project_01 to project_05 in parallel'
+    parser = argparse.ArgumentParser(usage=usage)
+
+    #positional arguments
+    parser.add_argument('root',
+        nargs='?',
+        default=str(PROJECTS),
+        help='the directory holding the project_0N directories')
+
+    #optional arguments
+    parser.add_argument('-j', '--jobs',
+        default=os.cpu_count() or 1,
+        type=int,
+        help='the number of chips to test in parallel')
+    parser.add_argument('-k', '--filter',
+        default=None,
+        help='only test chips whose name contains this text')
+    parser.add_argument('-v', '--verbose',
+        default=False,
+        action='store_true',
+        help='print the time of every script, not just of every chip')
+    parser.add_argument('-p', '--press-keys',
+        dest='press_keys',
+        default=False,
+        action='store_true',
+        help='press the keys scripts such as Memory.tst wait for, instead of failing them')
+    return parser.parse_args(args)
+
+def main(argv):
+    args = parse_args(argv)
+    start = time.perf_counter()
+    tests = discover(args.root)
+    if args.filter:
+        tests = {key : scripts for key, scripts in tests.items() if args.filter in key[1]}
+
+    graphs = {}
+    for directory, chip in tests:
+        try:
+            graphs[(directory, chip)] = dependencies(library(directory), chip)
+        except Exception:
+            #run_chip reports the error
+            graphs[(directory, chip)] = {chip : set()}
+    #the chips with the most parts below them usually take longest, so they go first
+    jobs = sorted(tests, key=lambda key: -len(graphs[key]))
+
+    if len(jobs) <= 1 or args.jobs <= 1:
+        results = [run_chip(directory, chip, tests[(directory, chip)], args.press_keys) for directory, chip in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(pool.map(run_chip,
+                [directory for directory, _ in jobs],
+                [chip for _, chip in jobs],
+                [tests[key] for key in jobs],
+                [args.press_keys] * len(jobs)))
+    elapsed = time.perf_counter() - start
+
+    failing = {chip for chip, scripts, _ in results if any(failure for _, failure, _, _ in scripts)}
+    root = Path(args.root)
+    total = 0
+    for (directory, _), (chip, scripts, seconds) in sorted(zip(jobs, results), key=lambda item: str(item[0][0]) + item[0][1]):
+        total += seconds
+        broken = sorted(part for part in graphs[(directory, chip)] if part != chip and part in failing)
+        print('{status} {chip:<12} {count} script{plural:<2} {ms:8.1f} ms  {directory}{note}'.format(
+            status='FAIL' if chip in failing else 'PASS',
+            chip=chip,
+            count=len(scripts),
+            plural='s' if len(scripts) != 1 else '',
+            ms=seconds * 1000,
+            directory=directory.relative_to(root) if directory.is_relative_to(root) else directory,
+            note='  (depends on failing {chips})'.format(chips=', '.join(broken)) if broken else ''))
+        for path, failure, script_seconds, pressed in scripts:
+            if args.verbose:
+                print('    {name:<28} {ms:8.1f} ms'.format(name=path.name, ms=script_seconds * 1000))
+            if pressed:
+                print('    {name}: pressed keys {keys} the script waited for'.format(name=path.name, keys=', '.join(str(key) for key in pressed)))
+            if failure:
+                print('    {name}: {failure}'.format(name=path.name, failure=failure.replace('\n', '\n    ')))
+
+    scripts = sum(len(scripts) for _, scripts, _ in results)
+    print('{passed} of {chips} chips passed ({scripts} scripts) in {ms:.1f} ms wall time, {total:.1f} ms of chip time on {jobs} processes'.format(
+        passed=len(results) - len(failing),
+        chips=len(results),
+        scripts=scripts,
+        ms=elapsed * 1000,
+        total=total * 1000,
+        jobs=max(1, min(args.jobs, len(jobs)))))
+    if failing:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
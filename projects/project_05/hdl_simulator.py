@@ -0,0 +1,1021 @@
+import re
+import sys
+import time
+import argparse
+import functools
+from pathlib import Path
+
+import numpy as np
+
+'''
+Simulates the chips of project_01 to project_05 and runs their .tst scripts against the
+.cmp files, without the external Java hardware simulator.
+
+A chip is flattened into a netlist of single-bit nets: every part is expanded, down to
+Nand gates and the builtin chips below, and connected wires are merged into one net. The
+netlist is then sorted into levels, where every gate only reads nets driven on earlier
+levels, so all the Nand gates of a level are evaluated by one NumPy operation. Each net
+holds a vector of values rather than a single bit, which lets a script that only sets
+inputs and evaluates, such as the ALU tests, run every row of its table in one sweep.
+Scripts that use the clock run step by step with vectors of length 1.
+
+Parts are looked up, in order, as an .hdl file next to the script, an .hdl file anywhere
+in project_01 to project_05, and a builtin chip, so Bit, Register and PC only fall back
+to their builtins when no .hdl file is found. The memory chips RAM8 to RAM16K always use
+their builtins unless they are the chip under test, as flattening 16K registers into
+gates would be far too slow. The chips no project implements in HDL are builtin only:
+Nand, DFF, ARegister, DRegister, ROM32K, Screen and Keyboard.
+'''
+
+HDL = '.hdl'
+PROJECTS = Path(__file__).resolve().parent.parent
+#the nets every netlist starts with
+FALSE = 0
+TRUE = 1
+#the most iterations of a while loop before a script is considered stuck
+MAX_LOOP = 100000
+MEMORY_CHIPS = {'RAM8', 'RAM64', 'RAM512', 'RAM4K', 'RAM16K'}
+
+def strip_hdl_comments(text):
+    return re.sub(r'//[^\n]*|/\*.*?\*/', ' ', text, flags=re.S)
+
+class Pin:
+    '''
+    One end of a connection: a name with an optional bit range, or a constant
+    '''
+
+    def __init__(self, text):
+        match = re.fullmatch(r'(\w+)(?:\[(\d+)(?:\.\.(\d+))?\])?', text.strip())
+        assert match, 'bad pin {pin}'.format(pin=text)
+        self.name = match.group(1)
+        self.low = int(match.group(2)) if match.group(2) is not None else None
+        self.high = int(match.group(3)) if match.group(3) is not None else self.low
+
+    def bits(self, width):
+        '''
+        Returns the bit indexes of the pin, given the width of the whole bus
+        '''
+        if self.low is None:
+            return list(range(width))
+        return list(range(self.low, self.high + 1))
+
+    def constant(self):
+        return self.name in ('true', 'false')
+
+def bus_bits(chip, name, pin, width):
+    '''
+    Returns the bit indexes of pin on the bus name of the given width, asserting they all lie on it
+    '''
+    bits = pin.bits(width)
+    for bit in bits:
+        assert bit < width, '{chip}: bit {bit} of {name} is outside its {width} bit bus'.format(
+            chip=chip, bit=bit, name=name, width=width)
+    return bits
+
+class ChipDefinition:
+    '''
+    A chip parsed from an .hdl file: its input and output pins with their widths, and its parts
+    '''
+
+    def __init__(self, name, inputs, outputs, parts):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        #list of (chip name, [(part pin, wire)])
+        self.parts = parts
+
+def parse_pins(text):
+    pins = {}
+    for declaration in text.split(','):
+        declaration = declaration.strip()
+        if not declaration:
+            continue
+        match = re.fullmatch(r'(\w+)(?:\s*\[\s*(\d+)\s*\])?', declaration)
+        assert match, 'bad pin declaration {pin}'.format(pin=declaration)
+        pins[match.group(1)] = int(match.group(2)) if match.group(2) else 1
+    return pins
+
+def parse_hdl(text):
+    '''
+    Returns the ChipDefinition in the text of an .hdl file
+    '''
+    text = strip_hdl_comments(text)
+    match = re.search(r'CHIP\s+(\w+)\s*\{(.*)\}', text, flags=re.S)
+    assert match, 'no CHIP definition found'
+    name, body = match.group(1), match.group(2)
+    inputs = re.search(r'\bIN\b(.*?);', body, flags=re.S)
+    outputs = re.search(r'\bOUT\b(.*?);', body, flags=re.S)
+    parts_text = body.split('PARTS:', 1)[1] if 'PARTS:' in body else ''
+    parts = []
+    for part in re.finditer(r'(\w+)\s*\((.*?)\)\s*;', parts_text, flags=re.S):
+        connections = []
+        for connection in part.group(2).split(','):
+            pin, wire = connection.split('=')
+            connections.append((Pin(pin), Pin(wire)))
+        parts.append((part.group(1), connections))
+    return ChipDefinition(name,
+        parse_pins(inputs.group(1)) if inputs else {},
+        parse_pins(outputs.group(1)) if outputs else {},
+        parts)
+
+class Builtin:
+    '''
+    A chip implemented in Python. Its outputs depend on the inputs listed in combinational
+    within the same time step; a clocked chip also latches its inputs on tick and updates
+    its state on tock. Values are arrays holding one number per vector.
+    '''
+    inputs = {}
+    outputs = {}
+    combinational = ()
+    clocked = False
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def evaluate(self, inputs):
+        return {}
+
+    def latch(self, inputs):
+        pass
+
+    def commit(self):
+        pass
+
+    def peek(self, index):
+        raise AssertionError('{chip} has no inspectable state'.format(chip=type(self).__name__))
+
+    def poke(self, index, value):
+        raise AssertionError('{chip} has no inspectable state'.format(chip=type(self).__name__))
+
+class Nand(Builtin):
+    #evaluated in bulk by Simulation.eval rather than through evaluate
+    inputs = {'a' : 1, 'b' : 1}
+    outputs = {'out' : 1}
+    combinational = ('a', 'b')
+
+    def evaluate(self, inputs):
+        return {'out' : 1 - (inputs['a'] & inputs['b'])}
+
+class Register(Builtin):
+    inputs = {'in' : 16, 'load' : 1}
+    outputs = {'out' : 16}
+    clocked = True
+
+    def __init__(self, vectors):
+        super().__init__(vectors)
+        self.state = np.zeros(vectors, dtype=np.int64)
+        self.next = self.state
+
+    def evaluate(self, inputs):
+        return {'out' : self.state}
+
+    def latch(self, inputs):
+        self.next = np.where(inputs['load'] == 1, inputs['in'], self.state)
+
+    def commit(self):
+        self.state = self.next
+
+    def peek(self, index):
+        #the contents of a register change on tick, although out only follows on tock
+        return self.next
+
+    def poke(self, index, value):
+        self.state = np.full(self.vectors, value, dtype=np.int64)
+        self.next = self.state
+
+class ARegister(Register):
+    pass
+
+class DRegister(Register):
+    pass
+
+class Bit(Register):
+    inputs = {'in' : 1, 'load' : 1}
+    outputs = {'out' : 1}
+
+class DFF(Register):
+    inputs = {'in' : 1}
+    outputs = {'out' : 1}
+
+    def latch(self, inputs):
+        self.next = inputs['in']
+
+class PC(Register):
+    inputs = {'in' : 16, 'load' : 1, 'inc' : 1, 'reset' : 1}
+
+    def latch(self, inputs):
+        self.next = np.where(inputs['reset'] == 1, 0,
+            np.where(inputs['load'] == 1, inputs['in'],
+            np.where(inputs['inc'] == 1, (self.state + 1) & 0xFFFF, self.state)))
+
+class RAM(Builtin):
+    '''
+    size words of 16 bits; out is the word at address, and in is written to it on the
+    clock when load is set
+    '''
+    size = 0
+    outputs = {'out' : 16}
+    combinational = ('address',)
+    clocked = True
+
+    def __init__(self, vectors):
+        super().__init__(vectors)
+        self.contents = np.zeros((self.size, vectors), dtype=np.int64)
+        self.writes = None
+
+    def evaluate(self, inputs):
+        return {'out' : self.contents[inputs['address'], np.arange(self.vectors)]}
+
+    def latch(self, inputs):
+        loads = np.nonzero(inputs['load'] == 1)[0]
+        self.writes = (inputs['address'][loads], loads, inputs['in'][loads])
+
+    def commit(self):
+        if self.writes is not None:
+            addresses, vectors, values = self.writes
+            self.contents[addresses, vectors] = values
+            self.writes = None
+
+    def peek(self, index):
+        return self.contents[index]
+
+    def poke(self, index, value):
+        self.contents[index] = value
+
+def ram_chip(name, address_bits):
+    return type(name, (RAM,), {
+        'size' : 1 << address_bits,
+        'inputs' : {'in' : 16, 'load' : 1, 'address' : address_bits}
+    })
+
+RAM8 = ram_chip('RAM8', 3)
+RAM64 = ram_chip('RAM64', 6)
+RAM512 = ram_chip('RAM512', 9)
+RAM4K = ram_chip('RAM4K', 12)
+RAM16K = ram_chip('RAM16K', 14)
+Screen = ram_chip('Screen', 13)
+
+class Keyboard(Builtin):
+    outputs = {'out' : 16}
+
+    def __init__(self, vectors):
+        super().__init__(vectors)
+        self.key = np.zeros(vectors, dtype=np.int64)
+
+    def evaluate(self, inputs):
+        return {'out' : self.key}
+
+    def peek(self, index):
+        return self.key
+
+    def poke(self, index, value):
+        self.key = np.full(self.vectors, value, dtype=np.int64)
+
+class ROM32K(Builtin):
+    inputs = {'address' : 15}
+    outputs = {'out' : 16}
+    combinational = ('address',)
+
+    def __init__(self, vectors):
+        super().__init__(vectors)
+        self.contents = np.zeros(32768, dtype=np.int64)
+
+    def evaluate(self, inputs):
+        return {'out' : self.contents[inputs['address']]}
+
+    def load(self, file_name):
+        '''
+        Loads the instructions of a textual .hack file
+        '''
+        with open(file_name, 'r') as file:
+            words = [int(line, 2) for line in file if line.strip()]
+        self.contents[:] = 0
+        self.contents[:len(words)] = words
+
+    def peek(self, index):
+        return np.full(self.vectors, self.contents[index], dtype=np.int64)
+
+    def poke(self, index, value):
+        self.contents[index] = value
+
+BUILTINS = {chip.__name__ : chip for chip in [
+    Nand, DFF, Bit, Register, ARegister, DRegister, PC,
+    RAM8, RAM64, RAM512, RAM4K, RAM16K, Screen, Keyboard, ROM32K
+]}
+
+def library_directories():
+    '''
+    Returns every directory of project_01 to project_05 holding .hdl files
+    '''
+    return sorted({path.parent for path in PROJECTS.glob('project_0[1-5]/**/*' + HDL)})
+
+class Library:
+    '''
+    Finds the definition of every chip a netlist needs, as described at the top of this file
+    '''
+
+    def __init__(self, directory=None, directories=None):
+        self.directory = Path(directory) if directory else None
+        self.directories = directories if directories is not None else library_directories()
+        self.definitions = {}
+        self.templates = {}
+
+    def find_hdl(self, name):
+        directories = ([self.directory] if self.directory else []) + self.directories
+        for directory in directories:
+            path = directory.joinpath(name + HDL)
+            if path.is_file():
+                return path
+        return None
+
+    def lookup(self, name, under_test=False):
+        '''
+        Returns the ChipDefinition or builtin class of the chip called name
+        '''
+        key = (name, under_test)
+        if key not in self.definitions:
+            path = None if name in MEMORY_CHIPS and not under_test else self.find_hdl(name)
+            if path:
+                with open(path, 'r') as file:
+                    self.definitions[key] = parse_hdl(file.read())
+            else:
+                assert name in BUILTINS, 'chip {chip} has no .hdl file or builtin'.format(chip=name)
+                self.definitions[key] = BUILTINS[name]
+        return self.definitions[key]
+
+    def template(self, name):
+        '''
+        Returns the flattened but unscheduled Netlist of the part called name, flattening
+        it only the first time, so every later use of the chip copies it instead
+        '''
+        if name not in self.templates:
+            self.templates[name] = Netlist(name, self, under_test=False)
+        return self.templates[name]
+
+class Netlist:
+    '''
+    A chip flattened into Nand gates and builtins over single-bit nets, sorted into levels.
+    The chip under test is scheduled; parts are flattened as templates, which are not.
+    '''
+
+    def __init__(self, name, library, under_test=True):
+        self.name = name
+        self.parents = [FALSE, TRUE]
+        #(a, b, out) nets of every Nand gate
+        self.nands = []
+        #(builtin class, {pin : nets}) of every builtin
+        self.builtins = []
+        #(chip name, builtin index or None, {output pin : nets}) of every part, outermost first
+        self.instances = []
+
+        chip = library.lookup(name, under_test=under_test)
+        self.inputs = {pin : self.new_nets(width) for pin, width in chip.inputs.items()}
+        if isinstance(chip, type):
+            self.outputs = self.add_builtin(chip, name, dict(self.inputs))
+        else:
+            self.outputs = self.flatten(chip, self.inputs, library)
+        self.resolve()
+        if under_test:
+            self.schedule()
+
+    def new_nets(self, width):
+        start = len(self.parents)
+        self.parents.extend(range(start, start + width))
+        return list(range(start, start + width))
+
+    def find(self, net):
+        parents = self.parents
+        while parents[net] != net:
+            parents[net] = parents[parents[net]]
+            net = parents[net]
+        return net
+
+    def union(self, first, second):
+        first = self.find(first)
+        second = self.find(second)
+        if first != second:
+            #constants stay the representative of their set
+            if second < first:
+                first, second = second, first
+            self.parents[second] = first
+
+    def add_builtin(self, builtin, name, pins):
+        '''
+        Adds a builtin given the nets of its inputs, and returns the nets of its outputs
+        '''
+        outputs = {pin : self.new_nets(width) for pin, width in builtin.outputs.items()}
+        if builtin is Nand:
+            self.nands.append((pins['a'][0], pins['b'][0], outputs['out'][0]))
+            return outputs
+        pins = dict(pins)
+        pins.update(outputs)
+        self.instances.append((name, len(self.builtins), outputs))
+        self.builtins.append((builtin, pins))
+        return outputs
+
+    def flatten(self, chip, inputs, library):
+        '''
+        Expands the parts of chip given the nets of its input pins, and returns the nets of its output pins
+        '''
+        definitions = [(part, library.lookup(part), connections) for part, connections in chip.parts]
+
+        #every wire driven by a part output, and every chip output, gets nets of its own
+        widths = {pin : width for pin, width in chip.outputs.items()}
+        for part, definition, connections in definitions:
+            for pin, wire in connections:
+                if pin.name in definition.outputs and wire.name not in chip.outputs:
+                    bits = bus_bits(chip.name, '{part}.{pin}'.format(part=part, pin=pin.name), pin, definition.outputs[pin.name])
+                    widths[wire.name] = max(widths.get(wire.name, 0), wire.high + 1 if wire.low is not None else len(bits))
+        wires = dict(inputs)
+        for wire, width in widths.items():
+            assert wire not in inputs, '{chip}: input pin {pin} cannot be driven by a part'.format(chip=chip.name, pin=wire)
+            wires[wire] = self.new_nets(width)
+
+        for part, definition, connections in definitions:
+            pins = {pin : [FALSE] * width for pin, width in definition.inputs.items()}
+            for pin, wire in connections:
+                assert pin.name in definition.inputs or pin.name in definition.outputs, \
+                    '{chip}: {part} has no pin {pin}'.format(chip=chip.name, part=part, pin=pin.name)
+                if pin.name not in definition.inputs:
+                    continue
+                bits = bus_bits(chip.name, '{part}.{pin}'.format(part=part, pin=pin.name), pin, definition.inputs[pin.name])
+                if wire.constant():
+                    nets = [TRUE if wire.name == 'true' else FALSE] * len(bits)
+                else:
+                    assert wire.name in wires, '{chip}: wire {wire} is never driven'.format(chip=chip.name, wire=wire.name)
+                    nets = [wires[wire.name][bit] for bit in bus_bits(chip.name, wire.name, wire, len(wires[wire.name]))]
+                assert len(nets) == len(bits), '{chip}: {part}.{pin} is {width} bits wide but is connected to {count}'.format(
+                    chip=chip.name, part=part, pin=pin.name, width=len(bits), count=len(nets))
+                for bit, net in zip(bits, nets):
+                    pins[pin.name][bit] = net
+
+            if isinstance(definition, type):
+                outputs = self.add_builtin(definition, part, pins)
+            else:
+                outputs = self.instantiate(library.template(part), pins)
+
+            for pin, wire in connections:
+                if pin.name not in definition.outputs:
+                    continue
+                bits = bus_bits(chip.name, '{part}.{pin}'.format(part=part, pin=pin.name), pin, definition.outputs[pin.name])
+                targets = bus_bits(chip.name, wire.name, wire, len(wires[wire.name]))
+                assert len(targets) == len(bits), '{chip}: {part}.{pin} is {width} bits wide but is connected to {count}'.format(
+                    chip=chip.name, part=part, pin=pin.name, width=len(bits), count=len(targets))
+                for bit, target in zip(bits, targets):
+                    self.union(outputs[pin.name][bit], wires[wire.name][target])
+
+        return {pin : wires[pin] for pin in chip.outputs}
+
+    def instantiate(self, template, inputs):
+        '''
+        Copies the gates of a flattened part given the nets of its inputs, and returns the
+        nets of its outputs
+        '''
+        #the nets of the template after the two constants become new nets here
+        offset = len(self.parents) - 2
+        self.new_nets(template.size - 2)
+        def net(number):
+            return number if number < 2 else number + offset
+        def nets(pins):
+            return {pin : [net(number) for number in numbers] for pin, numbers in pins.items()}
+
+        for pin, numbers in template.inputs.items():
+            for number, given in zip(numbers, inputs[pin]):
+                self.union(net(number), given)
+        outputs = nets(template.outputs)
+        first = len(self.builtins)
+        self.instances.append((template.name, None, outputs))
+        for name, index, pins in template.instances:
+            self.instances.append((name, None if index is None else index + first, nets(pins)))
+        self.nands.extend((net(a), net(b), net(out)) for a, b, out in template.nands)
+        self.builtins.extend((builtin, nets(pins)) for builtin, pins in template.builtins)
+        return outputs
+
+    def resolve(self):
+        '''
+        Replaces every net by the representative of the wires merged into it, and numbers
+        the representatives from 0
+        '''
+        numbers = {}
+        for net in range(len(self.parents)):
+            root = self.find(net)
+            if root not in numbers:
+                numbers[root] = len(numbers)
+        def number(net):
+            return numbers[self.find(net)]
+        self.size = len(numbers)
+        self.inputs = {pin : [number(net) for net in nets] for pin, nets in self.inputs.items()}
+        self.outputs = {pin : [number(net) for net in nets] for pin, nets in self.outputs.items()}
+        self.nands = [(number(a), number(b), number(out)) for a, b, out in self.nands]
+        self.builtins = [(builtin, {pin : [number(net) for net in nets] for pin, nets in pins.items()})
+            for builtin, pins in self.builtins]
+        self.instances = [(name, index, {pin : [number(net) for net in nets] for pin, nets in outputs.items()})
+            for name, index, outputs in self.instances]
+        self.parents = None
+
+    def schedule(self):
+        '''
+        Sorts the gates into levels, each only reading nets driven on earlier levels
+        '''
+        drivers = {}
+        #every node is ('nand', index) or ('builtin', index)
+        for index, (_, _, out) in enumerate(self.nands):
+            assert out not in drivers, '{chip} drives a wire from two outputs'.format(chip=self.name)
+            drivers[out] = ('nand', index)
+        for index, (builtin, pins) in enumerate(self.builtins):
+            for pin in builtin.outputs:
+                for net in pins[pin]:
+                    assert net not in drivers, '{chip} drives a wire from two outputs'.format(chip=self.name)
+                    drivers[net] = ('builtin', index)
+
+        def reads(node):
+            kind, index = node
+            if kind == 'nand':
+                return self.nands[index][:2]
+            builtin, pins = self.builtins[index]
+            return [net for pin in builtin.combinational for net in pins[pin]]
+
+        levels = {}
+        for start in list(drivers.values()):
+            if start in levels:
+                continue
+            #iterative depth first search, as chains of gates can be thousands long
+            stack = [(start, iter(reads(start)))]
+            visiting = {start}
+            while stack:
+                node, pending = stack[-1]
+                for net in pending:
+                    source = drivers.get(net)
+                    if source is None or source in levels:
+                        continue
+                    assert source not in visiting, '{chip} has a combinational loop'.format(chip=self.name)
+                    visiting.add(source)
+                    stack.append((source, iter(reads(source))))
+                    break
+                else:
+                    stack.pop()
+                    visiting.discard(node)
+                    levels[node] = 1 + max((levels[drivers[net]] for net in reads(node) if net in drivers), default=-1)
+
+        depth = 1 + max(levels.values(), default=-1)
+        nands = [[] for _ in range(depth)]
+        builtins = [[] for _ in range(depth)]
+        for (kind, index), level in levels.items():
+            (nands if kind == 'nand' else builtins)[level].append(index)
+        self.levels = []
+        for level in range(depth):
+            gates = np.array([self.nands[index] for index in sorted(nands[level])], dtype=np.intp).reshape(-1, 3)
+            self.levels.append((gates[:, 0], gates[:, 1], gates[:, 2], sorted(builtins[level])))
+        self.clocked = [index for index, (builtin, _) in enumerate(self.builtins) if builtin.clocked]
+
+    def find_instance(self, name):
+        '''
+        Returns the first (chip name, builtin index, outputs) of a part called name
+        '''
+        for instance in self.instances:
+            if instance[0] == name:
+                return instance
+        raise AssertionError('{chip} has no part {part}'.format(chip=self.name, part=name))
+
+@functools.lru_cache(maxsize=None)
+def weights(width):
+    return 1 << np.arange(width, dtype=np.int64)
+
+class Simulation:
+    '''
+    The values of every net of a Netlist, for a number of independent input vectors
+    '''
+
+    def __init__(self, netlist, vectors=1):
+        self.netlist = netlist
+        self.vectors = vectors
+        self.values = np.zeros((netlist.size, vectors), dtype=bool)
+        self.values[TRUE] = True
+        self.builtins = [builtin(vectors) for builtin, _ in netlist.builtins]
+
+    def read(self, nets):
+        return weights(len(nets)) @ self.values[nets]
+
+    def write(self, nets, value):
+        self.values[nets] = (np.asarray(value, dtype=np.int64)[None] >> np.arange(len(nets))[:, None]) & 1
+
+    def pins(self, index, names):
+        pins = self.netlist.builtins[index][1]
+        return {name : self.read(pins[name]) for name in names}
+
+    def set(self, pin, value):
+        '''
+        Sets an input pin to a number, or to an array with one number per vector
+        '''
+        assert pin in self.netlist.inputs, '{chip} has no input pin {pin}'.format(chip=self.netlist.name, pin=pin)
+        nets = self.netlist.inputs[pin]
+        self.write(nets, np.asarray(value, dtype=np.int64) & ((1 << len(nets)) - 1))
+
+    def get(self, pin):
+        '''
+        Returns the unsigned value of a pin of the chip, one per vector
+        '''
+        if pin in self.netlist.outputs:
+            return self.read(self.netlist.outputs[pin])
+        assert pin in self.netlist.inputs, '{chip} has no pin {pin}'.format(chip=self.netlist.name, pin=pin)
+        return self.read(self.netlist.inputs[pin])
+
+    def eval(self):
+        '''
+        Propagates the inputs and the state of the clocked builtins through every gate
+        '''
+        values = self.values
+        for a, b, out, builtins in self.netlist.levels:
+            if len(out):
+                values[out] = ~(values[a] & values[b])
+            for index in builtins:
+                builtin = self.builtins[index]
+                outputs = builtin.evaluate(self.pins(index, builtin.inputs))
+                pins = self.netlist.builtins[index][1]
+                for pin, value in outputs.items():
+                    self.write(pins[pin], value)
+
+    def tick(self):
+        '''
+        The rising edge of the clock: every clocked builtin latches its inputs
+        '''
+        self.eval()
+        for index in self.netlist.clocked:
+            builtin = self.builtins[index]
+            builtin.latch(self.pins(index, builtin.inputs))
+
+    def tock(self):
+        '''
+        The falling edge of the clock: every clocked builtin takes its latched state
+        '''
+        for index in self.netlist.clocked:
+            self.builtins[index].commit()
+        self.eval()
+
+    def part(self, name):
+        '''
+        Returns the builtin for the first part called name
+        '''
+        _, index, _ = self.netlist.find_instance(name)
+        assert index is not None, '{part} is not a builtin chip'.format(part=name)
+        return self.builtins[index]
+
+    def peek(self, name, index):
+        '''
+        Returns the state of the part called name at index, or the value of its out pin
+        if it is implemented in HDL
+        '''
+        _, builtin, outputs = self.netlist.find_instance(name)
+        if builtin is None:
+            return self.read(outputs['out'])
+        return self.builtins[builtin].peek(index)
+
+    def poke(self, name, index, value):
+        self.part(name).poke(index, value & 0xFFFF)
+
+def tokenize_script(text):
+    text = re.sub(r'//[^\n]*|/\*.*?\*/', ' ', text, flags=re.S)
+    return re.findall(r'"[^"]*"|[{},;]|[^\s{},;]+', text)
+
+def parse_script(tokens, position=0):
+    '''
+    Returns the commands of a .tst script and the position after them. A command is a
+    list of words, or ('repeat', count, body) or ('while', condition, body).
+    '''
+    commands = []
+    words = []
+    while position < len(tokens):
+        token = tokens[position]
+        position += 1
+        if token in (',', ';'):
+            if words:
+                commands.append(words)
+            words = []
+        elif token == '{':
+            body, position = parse_script(tokens, position)
+            if words[0] == 'repeat':
+                commands.append(('repeat', int(words[1]) if len(words) > 1 else None, body))
+            else:
+                commands.append(('while', words[1:], body))
+            words = []
+        elif token == '}':
+            break
+        else:
+            words.append(token)
+    if words:
+        commands.append(words)
+    return commands, position
+
+def parse_number(text):
+    '''
+    Returns the value of a script number: decimal, or %B binary, %X hex, %D decimal
+    '''
+    if text.startswith('%B'):
+        return int(text[2:], 2)
+    if text.startswith('%X'):
+        return int(text[2:], 16)
+    if text.startswith('%D'):
+        return int(text[2:])
+    return int(text)
+
+class Column:
+    '''
+    One column of an output-list, such as in%B3.1.3: a name, a format, and the widths of
+    the left padding, the value and the right padding
+    '''
+
+    def __init__(self, text):
+        match = re.fullmatch(r'([^%]+)%([BDXS])(\d+)\.(\d+)\.(\d+)', text)
+        assert match, 'bad output column {column}'.format(column=text)
+        self.name = match.group(1)
+        self.kind = match.group(2)
+        self.left, self.width, self.right = (int(match.group(num)) for num in (3, 4, 5))
+        part = re.fullmatch(r'(\w+)\[(\d*)\]', self.name)
+        self.part = part.group(1) if part else None
+        self.index = int(part.group(2)) if part and part.group(2) else 0
+
+    def header(self):
+        total = self.left + self.width + self.right
+        name = self.name[:total]
+        left = (total - len(name)) // 2
+        return ' ' * left + name + ' ' * (total - left - len(name))
+
+    def cell(self, value):
+        if self.kind == 'S':
+            text = str(value).ljust(self.width)
+        elif self.kind == 'D':
+            value = int(value)
+            text = str(value - 0x10000 if value & 0x8000 else value).rjust(self.width)
+        elif self.kind == 'X':
+            text = '{value:X}'.format(value=int(value)).rjust(self.width, '0')[-self.width:]
+        else:
+            text = '{value:b}'.format(value=int(value)).rjust(self.width, '0')[-self.width:]
+        if len(text) > self.width:
+            text = '*' * self.width
+        return ' ' * self.left + text + ' ' * self.right
+
+def format_row(columns, values):
+    return '|' + '|'.join(column.cell(value) for column, value in zip(columns, values)) + '|'
+
+def lines_match(expected, actual):
+    '''
+    Does an output line match a .cmp line, where * in the .cmp matches any character?
+    '''
+    if len(expected) != len(actual):
+        return False
+    return all(want == '*' or want == got for want, got in zip(expected, actual))
+
+def uses_clock(commands):
+    '''
+    Does a script need to run step by step, rather than in one sweep over all its rows?
+    '''
+    for command in commands:
+        if isinstance(command, tuple):
+            if command[0] == 'while' or uses_clock(command[2]):
+                return True
+        elif command[0] in ('tick', 'tock', 'ticktock', 'ROM32K') or '[' in ' '.join(command):
+            return True
+    return False
+
+class TestScript:
+    '''
+    Runs a .tst script, producing the lines it outputs and comparing them to its .cmp file
+    '''
+
+    def __init__(self, path, library=None, netlists=None, press_keys=False):
+        '''
+        Reads the script at path. Scripts such as Memory.tst wait in a while out <> KEY loop
+        for someone to press KEY; with press_keys the key is pressed for them and recorded
+        in pressed, otherwise the script fails.
+        '''
+        self.path = Path(path)
+        with open(self.path, 'r') as file:
+            self.commands, _ = parse_script(tokenize_script(file.read()))
+        self.library = library if library is not None else Library(self.path.parent)
+        #netlists already flattened, by chip name, so several scripts can share them
+        self.netlists = netlists if netlists is not None else {}
+        self.compare_to = None
+        self.output_file = None
+        self.press_keys = press_keys
+        self.pressed = []
+        self.columns = []
+        self.lines = []
+        self.time = 0
+        self.half = False
+        self.simulation = None
+        self.batched = not uses_clock(self.commands)
+        #in batch mode the inputs of every eval, and the inputs and eval of every output
+        self.inputs = {}
+        self.rows = []
+        self.outputs = []
+
+    def netlist(self, name):
+        if name not in self.netlists:
+            self.netlists[name] = Netlist(name, self.library)
+        return self.netlists[name]
+
+    def run(self):
+        '''
+        Executes the script and returns the lines it output
+        '''
+        self.execute(self.commands)
+        if self.batched and self.simulation is not None:
+            self.sweep()
+        return self.lines
+
+    def sweep(self):
+        '''
+        Evaluates every row of a batch mode script at once and formats its outputs
+        '''
+        netlist = self.simulation.netlist
+        simulation = Simulation(netlist, max(len(self.rows), 1))
+        for pin in netlist.inputs:
+            simulation.set(pin, np.array([row.get(pin, 0) for row in self.rows] or [0]))
+        if self.rows:
+            simulation.eval()
+        results = {pin : simulation.get(pin) for pin in netlist.outputs}
+        for columns, inputs, row in self.outputs:
+            values = []
+            for column in columns:
+                if column.name in netlist.outputs:
+                    values.append(results[column.name][row] if row >= 0 else 0)
+                else:
+                    values.append(inputs.get(column.name, 0))
+            self.lines.append(format_row(columns, values))
+
+    def value(self, column):
+        if column.name == 'time':
+            return '{time}{half}'.format(time=self.time, half='+' if self.half else '')
+        if column.part:
+            return self.simulation.peek(column.part, column.index)[0]
+        return self.simulation.get(column.name)[0]
+
+    def condition(self, words):
+        pin, operator, number = words
+        value = self.simulation.get(pin)[0]
+        if len(self.simulation.netlist.outputs.get(pin, self.simulation.netlist.inputs.get(pin, []))) == 16 and value & 0x8000:
+            value -= 0x10000
+        number = parse_number(number)
+        return {
+            '=' : value == number,
+            '<>' : value != number,
+            '<' : value < number,
+            '>' : value > number,
+            '<=' : value <= number,
+            '>=' : value >= number
+        }[operator]
+
+    def awaited_key(self, words):
+        '''
+        Returns KEY for a while out <> KEY condition on a chip with a keyboard, or None
+        '''
+        if words[1] == '<>':
+            for name, _, _ in self.simulation.netlist.instances:
+                if name == 'Keyboard':
+                    return parse_number(words[2])
+        return None
+
+    def press_awaited_key(self, words):
+        key = self.awaited_key(words)
+        if key is None or not self.condition(words):
+            return
+        assert self.press_keys, 'the script waits for key {key} to be pressed; run with --press-keys to press it'.format(key=key)
+        self.simulation.poke('Keyboard', 0, key)
+        self.pressed.append(key)
+
+    def execute(self, commands):
+        for command in commands:
+            if isinstance(command, tuple):
+                kind, argument, body = command
+                if kind == 'repeat':
+                    assert argument is not None, 'repeat without a count never ends'
+                    for _ in range(argument):
+                        self.execute(body)
+                else:
+                    self.press_awaited_key(argument)
+                    loops = 0
+                    while self.condition(argument):
+                        loops += 1
+                        assert loops <= MAX_LOOP, 'while {condition} never ended'.format(condition=' '.join(argument))
+                        self.execute(body)
+                continue
+
+            name = command[0]
+            if name == 'load':
+                self.simulation = Simulation(self.netlist(Path(command[1]).stem))
+            elif name == 'output-file':
+                self.output_file = self.path.parent.joinpath(command[1])
+            elif name == 'compare-to':
+                self.compare_to = self.path.parent.joinpath(command[1])
+            elif name == 'output-list':
+                self.columns = [Column(text) for text in command[1:]]
+                self.lines.append('|' + '|'.join(column.header() for column in self.columns) + '|')
+            elif name == 'set':
+                column = Column(command[1] + '%D1.1.1')
+                value = parse_number(command[2])
+                if column.part:
+                    self.simulation.poke(column.part, column.index, value)
+                elif self.batched:
+                    self.inputs[command[1]] = value & ((1 << len(self.simulation.netlist.inputs[command[1]])) - 1)
+                else:
+                    self.simulation.set(command[1], value)
+            elif name == 'eval':
+                if self.batched:
+                    self.rows.append(dict(self.inputs))
+                else:
+                    self.simulation.eval()
+            elif name in ('tick', 'tock', 'ticktock'):
+                if name != 'tock':
+                    self.simulation.tick()
+                    self.half = True
+                if name != 'tick':
+                    self.simulation.tock()
+                    self.time += 1
+                    self.half = False
+            elif name == 'output':
+                if self.batched:
+                    self.outputs.append((self.columns, dict(self.inputs), len(self.rows) - 1))
+                else:
+                    self.lines.append(format_row(self.columns, [self.value(column) for column in self.columns]))
+            elif name == 'ROM32K':
+                assert command[1] == 'load', 'unknown ROM32K command {command}'.format(command=command[1])
+                self.simulation.part('ROM32K').load(self.path.parent.joinpath(command[2]))
+            elif name in ('echo', 'clear-echo'):
+                pass
+            else:
+                raise AssertionError('unknown script command {command}'.format(command=name))
+
+    def compare(self):
+        '''
+        Returns None if the output matches the .cmp file, or a message describing the first difference
+        '''
+        assert self.compare_to, '{script} has no compare-to file'.format(script=self.path.name)
+        with open(self.compare_to, 'r') as file:
+            expected = [line.rstrip('\r\n') for line in file if line.strip()]
+        for number, (want, got) in enumerate(zip(expected, self.lines), start=1):
+            if not lines_match(want.strip(), got.strip()):
+                return 'comparison failure at line {line}:\n  expected {want}\n  actual   {got}'.format(
+                    line=number, want=want.strip(), got=got.strip())
+        if len(expected) != len(self.lines):
+            return 'expected {expected} lines but the script output {actual}'.format(expected=len(expected), actual=len(self.lines))
+        return None
+
+def run_test(path, library=None, netlists=None, press_keys=False):
+    '''
+    Runs the .tst script at path and returns (lines output, failure message or None)
+    '''
+    script = TestScript(path, library, netlists, press_keys)
+    lines = script.run()
+    return lines, script.compare()
+
+def parse_args(args):
+    usage = 'Runs .tst scripts of HDL chips and compares their output with the .cmp files'
+    parser = argparse.ArgumentParser(usage=usage)
+
+    #positional arguments
+    parser.add_argument('paths',
+        nargs='+',
+        help='the .tst scripts to run')
+
+    #optional arguments
+    parser.add_argument('-o', '--output',
+        default=False,
+        action='store_true',
+        help='write the output of each script to its output-file')
+    parser.add_argument('-p', '--press-keys',
+        dest='press_keys',
+        default=False,
+        action='store_true',
+        help='press the keys scripts such as Memory.tst wait for, instead of failing them')
+    return parser.parse_args(args)
+
+def main(argv):
+    args = parse_args(argv)
+    failures = 0
+    for path in args.paths:
+        start = time.perf_counter()
+        script = None
+        try:
+            script = TestScript(path, press_keys=args.press_keys)
+            lines = script.run()
+            failure = script.compare()
+        except Exception as error:
+            #a broken chip fails its own script rather than the whole run
+            lines = script.lines if script else []
+            failure = str(error) if isinstance(error, AssertionError) else '{kind}: {error}'.format(kind=type(error).__name__, error=error)
+        elapsed = time.perf_counter() - start
+        if args.output and script:
+            #scripts without an output-file directive write next to themselves
+            with open(script.output_file or Path(path).with_suffix('.out'), 'w') as file:
+                file.write('\n'.join(lines) + '\n')
+        print('{status} {path} ({ms:.1f} ms)'.format(status='FAIL' if failure else 'PASS', path=path, ms=elapsed * 1000))
+        if script and script.pressed:
+            print('  pressed keys {keys} the script waited for'.format(keys=', '.join(str(key) for key in script.pressed)))
+        if failure:
+            failures += 1
+            print('  ' + failure)
+    print('{passed} of {total} passed'.format(passed=len(args.paths) - failures, total=len(args.paths)))
+    return failures
+
+if __name__ == '__main__':
+    sys.exit(1 if main(sys.argv[1:]) else 0)
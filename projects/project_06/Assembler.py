@@ -1,8 +1,18 @@
+import os
 import sys
+import glob
+import time
+import argparse
+import concurrent.futures
 from pathlib import Path
-import re
+import itertools
+import functools
 from enum import Enum
 
+import packed_hack
+from linker import ObjectFile
+from build_cache import BuildCache, DEFAULT_SIZE
+
 '''
 The Hack assembler reads as input a text file named Prog.asm, containing a Hack
 assembly program, and produces as output a text file named Prog.hack, containing
@@ -22,18 +32,120 @@ a SymbolTable module that handles symbols,
 and a main program that drives the entire translation process.
 '''
 
+#bump whenever the encoding changes, so programs cached by older versions are not reused
+ASSEMBLER_VERSION = '1.0'
+
 SEMI_COLON_REGEX = r';'
 EQUALS_REGEX = r'='
 COMMENT = '//'
+INSTRUCTION_FORMAT = '{value:016b}\n'
+STDIO = '-'
+ASM = '.asm'
+HACK = '.hack'
+OBJECT = '.hobj'
+TEXT_FORMAT = 'text'
+PACKED_FORMAT = 'packed'
+PYTHON_BACKEND = 'python'
+NUMPY_BACKEND = 'numpy'
+#C-commands the peephole optimizer recognises
+INCREMENT = 'M=M+1'
+DECREMENT = 'M=M-1'
+POP = 'AM=M-1'
+STORE = 'M=D'
+RELOAD = 'D=M'
+#number of instructions collected before they are written out in one chunk
+CHUNK_SIZE = 4096
 
 class CommandType(Enum):
     ADDRESS = 0
     COMPUTE = 1
     LOAD = 2
 
+#comp bits (the a-bit followed by c1..c6) for every computation that uses A;
+#the same computations on M set the a-bit
+COMPUTATIONS = {
+    '0'   : 0b0101010,
+    '1'   : 0b0111111,
+    '-1'  : 0b0111010,
+    'D'   : 0b0001100,
+    'A'   : 0b0110000,
+    '!D'  : 0b0001101,
+    '!A'  : 0b0110001,
+    '-D'  : 0b0001111,
+    '-A'  : 0b0110011,
+    'D+1' : 0b0011111,
+    'A+1' : 0b0110111,
+    'D-1' : 0b0001110,
+    'A-1' : 0b0110010,
+    'D+A' : 0b0000010,
+    'D-A' : 0b0010011,
+    'A-D' : 0b0000111,
+    'D&A' : 0b0000000,
+    'D|A' : 0b0010101
+}
+
+JUMPS = {
+    None  : 0b000,
+    'JGT' : 0b001,
+    'JEQ' : 0b010,
+    'JGE' : 0b011,
+    'JLT' : 0b100,
+    'JNE' : 0b101,
+    'JLE' : 0b110,
+    'JMP' : 0b111
+}
+
+def build_dest_codes():
+    '''
+    Returns the 3 bit code of every dest mnemonic, in any ordering of its registers
+    '''
+    codes = {'' : 0b000}
+    for registers in itertools.chain.from_iterable(itertools.permutations('AMD', n) for n in range(1, 4)):
+        res = 0
+        if 'A' in registers:
+            res += 0b100
+        if 'M' in registers:
+            res += 0b001
+        if 'D' in registers:
+            res += 0b010
+        codes[''.join(registers)] = res
+    return codes
+
+def build_comp_codes():
+    '''
+    Returns the 7 bit code of all 28 comp mnemonics
+    '''
+    codes = dict(COMPUTATIONS)
+    for mnemonic, code in COMPUTATIONS.items():
+        if 'A' in mnemonic:
+            codes[mnemonic.replace('A', 'M')] = code | 0b1000000
+    return codes
+
+DEST_CODES = build_dest_codes()
+COMP_CODES = build_comp_codes()
+
+def build_instruction_codes():
+    '''
+    Returns the complete 16 bit instruction for the text of every legal dest=comp;jump command
+    '''
+    codes = {}
+    for dest, dest_code in DEST_CODES.items():
+        for comp, comp_code in COMP_CODES.items():
+            for jump, jump_code in JUMPS.items():
+                text = comp
+                if dest:
+                    text = '{dest}={comp}'.format(dest=dest, comp=text)
+                if jump:
+                    text = '{comp};{jump}'.format(comp=text, jump=jump)
+                codes[text] = 0b111 << 13 | comp_code << 6 | dest_code << 3 | jump_code
+    return codes
+
+INSTRUCTION_CODES = build_instruction_codes()
+
 class Code:
     '''
     Translates Hack assembly language mnemonics into binary codes.
+    All codes are looked up in tables built once at import time.
     '''
 
     @staticmethod
@@ -41,60 +153,47 @@ class Code:
         '''
         Returns the binary code of the dest mnemonic (3 bits).
         '''
-        res = 0
-        if 'A' in mnemonic:
-            res += 0b100
-        if 'M' in mnemonic:
-            res += 0b001
-        if 'D' in mnemonic:
-            res += 0b010
-        return '{res:03b}'.format(res=res)
+        return DEST_CODES[mnemonic]
 
     @staticmethod
     def comp(mnemonic):
         '''
         Returns the binary code of the comp mnemonic (7 bits.)
-            '''
-        a = '1' if 'M' in mnemonic else '0'
-        mnemonic = mnemonic.replace('M', 'A')
-        computation = {
-            '0'   : '101010',
-            '1'   : '111111',
-            '-1'  : '111010',
-            'D'   : '001100',
-            'A'   : '110000',
-            '!D'  : '001101',
-            '!A'  : '110001',
-            '-D'  : '001111',
-            '-A'  : '110011',
-            'D+1' : '011111',
-            'A+1' : '110111',
-            'D-1' : '001110',
-            'A-1' : '110010',
-            'D+A' : '000010',
-            'D-A' : '010011',
-            'A-D' : '000111',
-            'D&A' : '000000',
-            'D|A' : '010101'
-        }
-        return a + computation[mnemonic]
+        '''
+        return COMP_CODES[mnemonic]
 
     @staticmethod
     def jump(mnemonic):
         '''
         Returns the binary code of the jump mnemonic (3 bits).
         '''
-        jumpcode = {
-            None  : '000',
-            'JGT' : '001',
-            'JEQ' : '010',
-            'JGE' : '011',
-            'JLT' : '100',
-            'JNE' : '101',
-            'JLE' : '110',
-            'JMP' : '111'
-        }
-        return jumpcode[mnemonic]
+        return JUMPS[mnemonic]
+
+    @staticmethod
+    def instruction(command):
+        '''
+        Returns the complete 16 bit code of a C-command given as its raw dest=comp;jump text.
+        '''
+        return INSTRUCTION_CODES[command]
+
+def build_predefined_symbols():
+    '''
+    Returns the symbols every Hack program starts with and their addresses
+    '''
+    symbols = {}
+    symbols['SP'] = 0x0000
+    symbols['LCL'] = 0x0001
+    symbols['ARG'] = 0x0002
+    symbols['THIS'] = 0x0003
+    symbols['THAT'] = 0x0004
+    for i in range(16):
+        register = 'R{num}'.format(num=i)
+        symbols[register] = 0x0000 + i
+    symbols['SCREEN'] = 0x4000
+    symbols['KBD'] = 0x6000
+    return symbols
+
+PREDEFINED_SYMBOLS = build_predefined_symbols()
 
 class SymbolTable:
         '''
@@ -103,27 +202,36 @@ class SymbolTable:
 
         def __init__(self):
             '''
-            Creates a new empty symbol table
+            Creates a new symbol table holding only the predefined symbols
             '''
-            self.symbols = {}
-            self.add_pair('SP', 0x0000)
-            self.add_pair('LCL', 0x0001)
-            self.add_pair('ARG', 0x0002)
-            self.add_pair('THIS', 0x0003)
-            self.add_pair('THAT', 0x0004)
-            for i in range(16):
-                register = 'R{num}'.format(num=i)
-                self.add_pair(register, 0x0000 + i)
-            self.add_pair('SCREEN', 0x4000)
-            self.add_pair('KBD', 0x6000)
+            self.symbols = dict(PREDEFINED_SYMBOLS)
             self.next_label = 0x0010
 
+        def copy(self):
+            '''
+            Returns an independent copy of the table, so a pre-seeded table can serve as a
+            template for many programs
+            '''
+            table = SymbolTable.__new__(SymbolTable)
+            table.symbols = dict(self.symbols)
+            table.next_label = self.next_label
+            return table
+
         def add_pair(self, symbol, address):
             '''
             Adds the pair (symbol, address) to the table.
             '''
             self.symbols[symbol] = address
 
+        def add_variable(self, symbol):
+            '''
+            Adds symbol at the next free variable address and returns that address.
+            '''
+            address = self.next_label
+            self.add_pair(symbol, address)
+            self.next_label += 1
+            return address
+
         def contains(self, symbol):
             '''
             Does the symbol table contain the given symbol?
@@ -136,11 +244,88 @@ class SymbolTable:
             '''
             return self.symbols[symbol]
 
+def strip_comments(lines):
+    '''
+    Lazily yields each line with its newline, comment, and surrounding whitespace removed,
+    skipping lines that are left empty
+    '''
+    for line in lines:
+        if COMMENT in line:
+            line = line[:line.index(COMMENT)]
+        line = line.strip()
+        if line:
+            yield line
+
+class Instruction:
+    '''
+    A single assembly command decoded once into its fields: the pre-decoded form that
+    the assembler passes, and other tools, work on instead of the command text.
+        kind    the CommandType of the command
+        symbol  the Xxx of @Xxx or (Xxx), None for C-commands
+        value   the number of @Xxx when Xxx is a decimal number, otherwise None
+        dest, comp, jump
+                the mnemonics of a C-command ('' when there is no dest, None when
+                there is no jump), None for other commands
+        code    the 16 bit word of a C-command or numeric A-command, None when the
+                word depends on the symbol table
+    Decoded instructions are shared between every occurrence of the same command text,
+    so they must not be modified.
+    '''
+    __slots__ = ('text', 'kind', 'symbol', 'value', 'dest', 'comp', 'jump', 'code')
+
+    def __init__(self, text, kind, symbol=None, value=None, dest=None, comp=None, jump=None, code=None):
+        self.text = text
+        self.kind = kind
+        self.symbol = symbol
+        self.value = value
+        self.dest = dest
+        self.comp = comp
+        self.jump = jump
+        self.code = code
+
+    def __repr__(self):
+        return 'Instruction({text!r})'.format(text=self.text)
+
+@functools.lru_cache(maxsize=4096)
+def decode(command):
+    '''
+    Returns the Instruction for a single command with comments and whitespace already removed:
+    A_COMMAND for @Xxx where Xxx is either a symbol or a decimal number
+    C_COMMAND for dest=comp;jump
+    L_COMMAND for (Xxx) where Xxx is a symbol.
+    '''
+    if '@' in command:
+        symbol = command[1:]
+        if symbol.isdigit():
+            value = int(symbol)
+            return Instruction(command, CommandType.ADDRESS, symbol, value, code=value)
+        return Instruction(command, CommandType.ADDRESS, symbol)
+    elif '(' in command:
+        return Instruction(command, CommandType.LOAD, command[1:-1])
+
+    #Reminder that Compute instructions take the form of Dest=Comp;Jump
+    #dest or jump may be empty
+    dest, _, comp = command.rpartition(EQUALS_REGEX)
+    comp, _, jump = comp.partition(SEMI_COLON_REGEX)
+    jump = jump or None
+    code = INSTRUCTION_CODES.get(command)
+    if code is None:
+        #an unusual spelling, such as an unordered dest
+        code = 0b111 << 13 | Code.comp(comp) << 6 | Code.dest(dest) << 3 | Code.jump(jump)
+    return Instruction(command, CommandType.COMPUTE, dest=dest, comp=comp, jump=jump, code=code)
+
+def decode_program(lines):
+    '''
+    Returns the list of decoded Instructions for the given lines of assembly
+    '''
+    return [decode(command) for command in strip_comments(lines)]
+
 class Parser:
     '''
     Encapsulates access to the input code. Reads an assembly language command, parses it,
     and provides convenient access to the command’s components (fields and symbols).
     In addition, removes all white space and comments.
+    Every command is decoded into an Instruction exactly once, when the file is read.
     '''
 
     def __init__(self, file_name):
@@ -149,7 +334,7 @@ class Parser:
         Generate a stream instance to use in other methods
         '''
         file = open(file_name, 'r')
-        self.lines = self.remove_decorators(file.readlines())
+        self.instructions = decode_program(file)
         file.close()
         self.reset()
         self.symbol_table = SymbolTable()
@@ -157,26 +342,13 @@ class Parser:
     def reset(self):
         self.next_line = 0
         self.current_command = None
-
-    def remove_decorators(self, lines):
-        '''
-        returns a list of lines containing no extra newlines, comments, and whitespace
-        '''
-        res = []
-        for line in lines:
-            line=line.strip()
-            if COMMENT in line:
-                comment_index = line.index(COMMENT)
-                line = line[:comment_index]
-            if line:
-                res.append(line.strip())
-        return res
+        self.current = None
 
     def has_more_commands(self):
         '''
         Returns true if the stream is not empty
         '''
-        return self.next_line < len(self.lines)
+        return self.next_line < len(self.instructions)
 
     def advance(self):
         '''
@@ -185,9 +357,18 @@ class Parser:
         if hasMoreCommands() is true.
         Initially there is no current command
         '''
-        self.current_command = self.lines[self.next_line]
+        self.current = self.instructions[self.next_line]
+        self.current_command = self.current.text
         self.next_line += 1
 
+    def decoded(self):
+        '''
+        Yields the Instruction of every remaining command, advancing through the input
+        '''
+        while self.has_more_commands():
+            self.advance()
+            yield self.current
+
     def command_type(self):
         '''
         Returns the type of the current command:
@@ -195,12 +376,7 @@ class Parser:
         C_COMMAND for dest=comp;jump
         L_COMMAND for (Xxx) where Xxx is a symbol.
         '''
-        if '@' in self.current_command:
-            return CommandType.ADDRESS
-        elif '(' in self.current_command:
-            return CommandType.LOAD
-        else:
-            return CommandType.COMPUTE
+        return self.current.kind
 
     def symbol(self):
         '''
@@ -208,93 +384,634 @@ class Parser:
         @Xxx or (Xxx). Should be called only when commandType() is
         A_COMMAND or L_COMMAND.
         '''
-        if self.command_type() == CommandType.ADDRESS:
-            return self.current_command[1:]
-        else:
-            return self.current_command[1:-1]
+        return self.current.symbol
 
-    #Reminder that Compute instructions take the form of Dest=Comp;Jump
-    #dest or jump may be empty
     def dest(self):
         '''
         Returns the dest mnemonic in the current C-command (8 possibilities).
         Should be called only when commandType() is C_COMMAND
         '''
-        dest = ''
-        if EQUALS_REGEX in self.current_command:
-            dest, _ = re.split(EQUALS_REGEX, self.current_command)
-        return Code.dest(dest)
+        return Code.dest(self.current.dest)
 
     def comp(self):
         '''
         Returns the comp mnemonic in the current C-command (28 possibilities).
         Should be called only when commandType() is C_COMMAND.
         '''
-        comp = self.current_command
-        if EQUALS_REGEX in comp:
-            _, comp = re.split(EQUALS_REGEX, comp)
-
-        if SEMI_COLON_REGEX in comp:
-            comp, _ = re.split(SEMI_COLON_REGEX, comp)
-        return Code.comp(comp)
+        return Code.comp(self.current.comp)
 
     def jump(self):
         '''
         Returns the jump mnemonic in the current C-command (8 possibilities).
         Should be called only when commandType() is C_COMMAND.
         '''
-        jump = None
-        if SEMI_COLON_REGEX in self.current_command:
-            _, jump = re.split(SEMI_COLON_REGEX, self.current_command)
-        return Code.jump(jump)
+        return Code.jump(self.current.jump)
 
-def generate_symbols(parser, symbol_table):
-    instruction = 0
-    while parser.has_more_commands():
-        parser.advance()
-        if parser.command_type() == CommandType.LOAD:
-            symbol_table.add_pair(parser.symbol(), instruction)
+    def instruction(self):
+        '''
+        Returns the complete 16 bit code of the current C-command.
+        Should be called only when commandType() is C_COMMAND.
+        '''
+        return self.current.code
+
+class StreamParser(Parser):
+    '''
+    A Parser that pulls commands lazily from an open stream instead of reading the whole
+    file into memory. Only a single command of lookahead is held at any time.
+    reset() rewinds the stream, so a second pass is only possible on seekable input.
+    '''
+
+    def __init__(self, stream):
+        '''
+        Prepare to parse the commands read from stream
+        '''
+        self.stream = stream
+        self.reset()
+
+    def reset(self):
+        if self.stream.seekable():
+            self.stream.seek(0)
+        self.commands = strip_comments(self.stream)
+        self.upcoming = next(self.commands, None)
+        self.current_command = None
+        self.current = None
+
+    def has_more_commands(self):
+        '''
+        Returns true if the stream is not empty
+        '''
+        return self.upcoming is not None
+
+    def advance(self):
+        '''
+        Reads the next command from the stream and makes it the current command.
+        Should be called only if hasMoreCommands() is true.
+        '''
+        self.current_command = self.upcoming
+        self.current = decode(self.current_command)
+        self.upcoming = next(self.commands, None)
+
+class InstructionParser(Parser):
+    '''
+    A Parser over instructions that are already decoded, such as the output of the optimizer
+    '''
+
+    def __init__(self, instructions):
+        self.instructions = list(instructions)
+        self.reset()
+
+class ChunkedWriter:
+    '''
+    Collects written instructions and hands them to the underlying file in large chunks
+    '''
+
+    def __init__(self, file, chunk_size=CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.pending = []
+
+    def write(self, text):
+        self.pending.append(text)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes out everything collected so far
+        '''
+        self.file.write(''.join(self.pending))
+        self.pending = []
+        self.file.flush()
+
+    def close(self):
+        '''
+        Flushes and closes the underlying file
+        '''
+        self.flush()
+        self.file.close()
+
+def collect_labels(instructions, symbol_table):
+    '''
+    The symbol pass: adds the address of every (Xxx) among the decoded instructions to the symbol table
+    '''
+    address = 0
+    for instruction in instructions:
+        if instruction.kind == CommandType.LOAD:
+            symbol_table.add_pair(instruction.symbol, address)
         else:
-            instruction += 1
+            address += 1
+
+def encode_instructions(instructions, symbol_table):
+    '''
+    The encode pass: yields the 16 bit word of every decoded instruction, resolving symbols
+    against a symbol table already filled in by collect_labels
+    '''
+    for instruction in instructions:
+        if instruction.code is not None:
+            yield instruction.code
+        elif instruction.kind == CommandType.ADDRESS:
+            symbol = instruction.symbol
+            if not symbol_table.contains(symbol):
+                symbol_table.add_variable(symbol)
+            yield symbol_table.get_address(symbol)
+        #loads produce no instruction
+
+def generate_symbols(parser, symbol_table):
+    collect_labels(parser.decoded(), symbol_table)
     parser.reset()
 
-def parse_assembly(parser, symbol_table, outfile):
-    next_var = 16
-    while parser.has_more_commands():
-        parser.advance()
-        cmd_type = parser.command_type()
-        if cmd_type == CommandType.ADDRESS:
-            symbol = parser.symbol()
-            if not symbol.isdigit():
-                if symbol_table.contains(symbol):
-                    symbol = symbol_table.get_address(symbol)
-                else:
-                    symbol_table.add_pair(symbol, next_var)
-                    symbol = next_var
-                    next_var += 1
-            next_command = '0{value:015b}'.format(value=int(symbol))
-        if cmd_type == CommandType.COMPUTE:
-            next_command = '111{comp}{dest}{jump}'.format(comp=parser.comp(), dest=parser.dest(), jump=parser.jump())
-        if cmd_type != CommandType.LOAD:
-            #ignore loads
-            outfile.write(next_command + '\n')
-
-def main():
-    path = Path(sys.argv[1])
-    parser = Parser(path)
-    symbol_table = SymbolTable()
+def encode_assembly(parser, symbol_table):
+    '''
+    Yields the 16 bit word of every instruction, resolving symbols against a symbol table
+    already filled in by generate_symbols
+    '''
+    return encode_instructions(parser.decoded(), symbol_table)
+
+def encode_single_pass(parser, symbol_table):
+    '''
+    Returns the 16 bit words of the program after a single read of the parser, instead of
+    generate_symbols followed by encode_assembly. An @Xxx whose symbol is not yet known
+    is recorded as unresolved and backpatched when its (Xxx) definition is read. Symbols
+    still unresolved at the end of the program are variables, allocated in order of first
+    use exactly like encode_assembly does, so the output is identical to the two-pass
+    translation.
+    '''
+    instructions = []
+    unresolved = {}
+    for instruction in parser.decoded():
+        if instruction.code is not None:
+            instructions.append(instruction.code)
+        elif instruction.kind == CommandType.LOAD:
+            label = instruction.symbol
+            address = len(instructions)
+            symbol_table.add_pair(label, address)
+            for index in unresolved.pop(label, []):
+                instructions[index] = address
+        elif symbol_table.contains(instruction.symbol):
+            instructions.append(symbol_table.get_address(instruction.symbol))
+        else:
+            unresolved.setdefault(instruction.symbol, []).append(len(instructions))
+            instructions.append(None)
+
+    #whatever is left was never defined as a label, so it is a variable
+    for symbol, indexes in unresolved.items():
+        address = symbol_table.add_variable(symbol)
+        for index in indexes:
+            instructions[index] = address
+    return instructions
 
+def encode_object(parser, symbol_table):
+    '''
+    Returns a relocatable ObjectFile for the program, to be combined with others by the
+    linker. Numbers and predefined symbols are encoded directly. Labels defined in this
+    program are encoded as offsets from its start and listed as relocations; all other
+    symbols are left as references, in order of first use, for the linker to resolve.
+    '''
+    code = []
+    labels = {}
+    references = {}
+    for instruction in parser.decoded():
+        if instruction.code is not None:
+            code.append(instruction.code)
+        elif instruction.kind == CommandType.LOAD:
+            labels[instruction.symbol] = len(code)
+        elif symbol_table.contains(instruction.symbol):
+            code.append(symbol_table.get_address(instruction.symbol))
+        else:
+            references.setdefault(instruction.symbol, []).append(len(code))
+            code.append(0)
+
+    relocations = []
+    for label, offset in labels.items():
+        for index in references.pop(label, []):
+            code[index] = offset
+            relocations.append(index)
+    relocations.sort()
+    return ObjectFile(code, labels, relocations, references)
+
+def write_words(words, outfile):
+    '''
+    Writes each word to outfile as a line of the textual .hack format
+    '''
+    for word in words:
+        outfile.write(INSTRUCTION_FORMAT.format(value=word))
+
+#A peephole optimizer for decoded Hack assembly. It runs on the Instruction stream
+#before any symbol is resolved, so removing instructions moves the labels after them
+#automatically. Each rule only removes instructions whose effect is provably dead or
+#redundant, assuming, as all generated code does, that control only ever reaches an
+#instruction by falling through or by jumping to a label:
+#
+#   unreachable code    instructions after an unconditional jump, up to the next label
+#   redundant loads     @Xxx when A is already known to hold Xxx, and @Xxx immediately
+#                       overwritten by another A-command
+#   stack adjustments   M=M+1 followed by AM=M-1 becomes A=M, and M=M+1 followed by M=M-1
+#                       (or the reverse) disappears
+#   reloads             D=M right after M=D
+#   jumps to the next instruction
+#                       @Xxx and a jump straight into the (Xxx) that follows, as long as the
+#                       code after the label sets A itself
+
+def is_unconditional_jump(instruction):
+    return instruction.kind == CommandType.COMPUTE and instruction.jump == 'JMP'
+
+def writes_a(instruction):
+    return instruction.kind == CommandType.COMPUTE and 'A' in instruction.dest
+
+def remove_unreachable(instructions):
+    '''
+    Drops everything between an unconditional jump and the next label
+    '''
+    result = []
+    reachable = True
+    for instruction in instructions:
+        if instruction.kind == CommandType.LOAD:
+            reachable = True
+        if reachable:
+            result.append(instruction)
+        if is_unconditional_jump(instruction):
+            reachable = False
+    return result
+
+def remove_redundant_loads(instructions):
+    '''
+    Drops A-commands whose value is already in A, or that the next A-command overwrites
+    '''
+    result = []
+    known = None
+    for index, instruction in enumerate(instructions):
+        if instruction.kind == CommandType.LOAD:
+            #control may arrive here from anywhere
+            known = None
+        elif instruction.kind == CommandType.ADDRESS:
+            following = instructions[index + 1] if index + 1 < len(instructions) else None
+            if instruction.symbol == known:
+                continue
+            if following is not None and following.kind == CommandType.ADDRESS:
+                continue
+            known = instruction.symbol
+        elif writes_a(instruction):
+            known = None
+        result.append(instruction)
+    return result
+
+def fold_pairs(instructions):
+    '''
+    Folds pairs of adjacent C-commands on the same address into one, or none
+    '''
+    result = []
+    for instruction in instructions:
+        previous = result[-1] if result else None
+        if previous is not None and previous.kind == CommandType.COMPUTE and instruction.kind == CommandType.COMPUTE:
+            pair = (previous.text, instruction.text)
+            if pair == (INCREMENT, POP):
+                #RAM[A] ends where it started and A takes its value
+                result[-1] = decode('A=M')
+                continue
+            if pair in [(INCREMENT, DECREMENT), (DECREMENT, INCREMENT)]:
+                result.pop()
+                continue
+            if pair == (STORE, RELOAD):
+                continue
+        result.append(instruction)
+    return result
+
+def remove_jumps_to_next(instructions):
+    '''
+    Drops @Xxx and a jump whose target (Xxx) immediately follows them. The jump left A
+    holding Xxx, so this is only done when the code after the label loads A before using it.
+    '''
+    result = []
+    index = 0
+    while index < len(instructions):
+        instruction = instructions[index]
+        if (instruction.kind == CommandType.ADDRESS and index + 1 < len(instructions)
+                and instructions[index + 1].kind == CommandType.COMPUTE
+                and instructions[index + 1].jump is not None
+                and instructions[index + 1].dest == ''):
+            following = index + 2
+            labels = set()
+            while following < len(instructions) and instructions[following].kind == CommandType.LOAD:
+                labels.add(instructions[following].symbol)
+                following += 1
+            next_sets_a = following == len(instructions) or instructions[following].kind == CommandType.ADDRESS
+            if instruction.symbol in labels and next_sets_a:
+                index += 2
+                continue
+        result.append(instruction)
+        index += 1
+    return result
+
+PEEPHOLE_PASSES = [remove_unreachable, remove_redundant_loads, fold_pairs, remove_jumps_to_next]
+
+def count_instructions(instructions):
+    '''
+    Returns the number of instructions that end up in ROM, leaving out labels
+    '''
+    return sum(1 for instruction in instructions if instruction.kind != CommandType.LOAD)
+
+def uses_absolute_jumps(instructions):
+    '''
+    Does the program jump to numeric addresses, like the label-less PongL.asm does?
+    Such programs break when instructions move, so they are left alone.
+    '''
+    has_labels = False
+    has_jumps = False
+    for previous, instruction in zip([None] + instructions, instructions):
+        if instruction.kind == CommandType.LOAD:
+            has_labels = True
+        elif instruction.kind == CommandType.COMPUTE and instruction.jump is not None:
+            has_jumps = True
+            if previous is not None and previous.kind == CommandType.ADDRESS and previous.value is not None:
+                return True
+    return has_jumps and not has_labels
+
+def optimize(instructions):
+    '''
+    Returns the decoded instructions with every peephole pass applied until none of them
+    removes anything more. Programs that jump to numeric addresses are returned unchanged.
+    '''
+    instructions = list(instructions)
+    if uses_absolute_jumps(instructions):
+        return instructions
+    while True:
+        size = len(instructions)
+        for optimization in PEEPHOLE_PASSES:
+            instructions = optimization(instructions)
+        if len(instructions) == size:
+            return instructions
+
+#copied by assemble() for every program it translates
+SYMBOL_TABLE_TEMPLATE = SymbolTable()
+
+def assemble(source, template=None, optimized=False, as_text=False):
+    '''
+    Assembles a program held in memory, without any file I/O.
+    source is either a string holding the whole program or an iterable of its lines.
+    Symbols are resolved against a copy of template, a SymbolTable that may be pre-seeded
+    with extra symbols and is never modified; by default only the predefined symbols are known.
+    New variables are allocated after those of the template:
+
+    >>> template = SymbolTable()
+    >>> template.add_variable('shared')
+    16
+    >>> assemble(['@shared', 'M=1', '@mine', 'M=0'], template=template)
+    [16, 61384, 17, 60040]
+
+    Returns the list of instruction words, or the textual .hack contents if as_text is set.
+    '''
+    if isinstance(source, str):
+        source = source.splitlines()
+    instructions = decode_program(source)
+    if optimized:
+        instructions = optimize(instructions)
+    symbol_table = (template or SYMBOL_TABLE_TEMPLATE).copy()
+    collect_labels(instructions, symbol_table)
+    words = list(encode_instructions(instructions, symbol_table))
+    if as_text:
+        return ''.join(INSTRUCTION_FORMAT.format(value=word) for word in words)
+    return words
+
+def encode(parser, symbol_table, single_pass):
+    '''
+    Returns the instruction words of the program, translated in one or two passes
+    '''
+    if single_pass:
+        return encode_single_pass(parser, symbol_table)
     generate_symbols(parser, symbol_table)
+    return encode_assembly(parser, symbol_table)
+
+def assemble_stdin(args):
+    '''
+    Assembles the program read from stdin and writes the result to stdout
+    '''
+    symbol_table = SymbolTable()
+    parser = StreamParser(sys.stdin)
+    if args.optimize:
+        parser = InstructionParser(optimize(parser.decoded()))
+    if args.object:
+        encode_object(parser, symbol_table).dump(sys.stdout)
+        return
+
+    #a pipe can only be read once, so it is always assembled in a single pass
+    words = encode_single_pass(parser, symbol_table)
+    if args.format == PACKED_FORMAT:
+        packed_hack.write_packed(words, sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    elif args.backend == NUMPY_BACKEND:
+        import numpy_backend
+        numpy_backend.write_words(words, sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+    else:
+        outfile = ChunkedWriter(sys.stdout)
+        write_words(words, outfile)
+        outfile.flush()
+
+def assemble_file(path, args):
+    '''
+    Assembles the .asm file at path as the command line options ask.
+    Returns the path written and how many instructions the optimizer saved, which is
+    None when the optimizer did not run.
+    '''
+    symbol_table = SymbolTable()
+    packed = args.format == PACKED_FORMAT
+    cache = None
+    words = None
+    saved = None
+    #the cache holds whole programs, which would defeat the flat memory use of streaming
+    if args.cache and not args.object and not args.stream:
+        cache = BuildCache(args.cache_dir, args.cache_size)
+        version = ASSEMBLER_VERSION + ('-O' if args.optimize else '')
+        key = cache.key(path, version)
+        words, saved = cache.get(key)
+
+    infile = None
+    if words is None:
+        if args.stream:
+            infile = open(path, 'r')
+            parser = StreamParser(infile)
+        else:
+            parser = Parser(path)
+
+        if args.optimize:
+            instructions = list(parser.decoded())
+            optimized = optimize(instructions)
+            saved = count_instructions(instructions) - count_instructions(optimized)
+            parser = InstructionParser(optimized)
+
+        if args.object:
+            write_file = path.parent.joinpath('{name}{suffix}'.format(name=path.stem, suffix=OBJECT))
+            encode_object(parser, symbol_table).write(write_file)
+            if infile:
+                infile.close()
+            return write_file, saved
+
+        words = encode(parser, symbol_table, args.single_pass)
+        if cache:
+            words = list(words)
+            cache.put(key, words, saved)
 
     parent = path.parent
-    name = '{name}.hack'.format(name=path.stem)
+    name = '{name}{suffix}'.format(name=path.stem, suffix=packed_hack.PACKED if packed else HACK)
     write_file = parent.joinpath(name)
-    outfile = open(write_file, 'w')
 
-    parse_assembly(parser, symbol_table, outfile)
+    if packed:
+        outfile = open(write_file, 'wb')
+        packed_hack.write_packed(words, outfile)
+    elif args.backend == NUMPY_BACKEND:
+        #imported here so NumPy is only needed when it is asked for
+        import numpy_backend
+        outfile = open(write_file, 'wb')
+        numpy_backend.write_words(words, outfile)
+    else:
+        outfile = open(write_file, 'w')
+        if args.stream:
+            outfile = ChunkedWriter(outfile)
+        write_words(words, outfile)
 
     outfile.close()
-    print('created file {file}'.format(file=write_file))
+    if infile:
+        infile.close()
+    return write_file, saved
+
+def assemble_job(path, args):
+    '''
+    Assembles one file for the process pool. Returns (path, written file, seconds taken,
+    instructions saved by the optimizer, error message) and never raises.
+    '''
+    start = time.perf_counter()
+    try:
+        write_file, saved = assemble_file(path, args)
+        error = None
+    except Exception as e:
+        write_file = saved = None
+        error = '{kind}: {message}'.format(kind=type(e).__name__, message=e)
+    return path, write_file, time.perf_counter() - start, saved, error
+
+def find_files(patterns):
+    '''
+    Returns the .asm files named by the given paths, directories, and glob patterns,
+    sorted and without duplicates. Directories contribute the .asm files directly inside them.
+    '''
+    files = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            path = Path(match)
+            if path.is_dir():
+                files.update(child for child in path.iterdir() if child.suffix == ASM)
+            else:
+                files.add(path)
+    return sorted(files)
+
+def parse_args(args):
+    usage = 'Translates the given Hack .asm files into .hack files'
+    parser = argparse.ArgumentParser(usage=usage)
+
+    #positional arguments
+    parser.add_argument('paths',
+        nargs='*',
+        help='the .asm files, directories of .asm files, or glob patterns to assemble, or - to assemble stdin to stdout')
+
+    #optional arguments
+    parser.add_argument('-s', '--single-pass',
+        dest='single_pass',
+        default=False,
+        action='store_true',
+        help='read the program once, backpatching forward label references')
+    parser.add_argument('--stream',
+        default=False,
+        action='store_true',
+        help='read the program lazily and write the output in large chunks, bypassing the build cache')
+    parser.add_argument('-f', '--format',
+        default=TEXT_FORMAT,
+        choices=[TEXT_FORMAT, PACKED_FORMAT],
+        help='write textual .hack output or packed binary .hackp output')
+    parser.add_argument('-c', '--object',
+        default=False,
+        action='store_true',
+        help='write a relocatable .hobj object file for the linker instead of a program')
+    parser.add_argument('-O', '--optimize',
+        default=False,
+        action='store_true',
+        help='remove dead and redundant instructions with the peephole optimizer before encoding')
+    parser.add_argument('-b', '--backend',
+        default=PYTHON_BACKEND,
+        choices=[PYTHON_BACKEND, NUMPY_BACKEND],
+        help='render textual output line by line, or all at once with NumPy')
+    parser.add_argument('--no-cache',
+        dest='cache',
+        default=True,
+        action='store_false',
+        help='always assemble, neither reading nor filling the build cache')
+    parser.add_argument('--clear-cache',
+        dest='clear_cache',
+        default=False,
+        action='store_true',
+        help='remove every entry from the build cache before assembling')
+    parser.add_argument('--cache-dir',
+        dest='cache_dir',
+        default=None,
+        help='the directory of the build cache')
+    parser.add_argument('--cache-size',
+        dest='cache_size',
+        default=DEFAULT_SIZE,
+        type=int,
+        help='the size in bytes the build cache is kept under')
+    parser.add_argument('-j', '--jobs',
+        default=os.cpu_count() or 1,
+        type=int,
+        help='the number of files to assemble in parallel')
+    args = parser.parse_args(args)
+    if not args.paths and not args.clear_cache:
+        parser.error('the path of the .asm file to assemble is required')
+    if STDIO in args.paths and len(args.paths) > 1:
+        parser.error('- cannot be combined with other paths')
+    for pattern in args.paths:
+        if glob.has_magic(pattern) and not glob.glob(pattern):
+            parser.error('no files match {pattern}'.format(pattern=pattern))
+    return args
+
+def main(argv):
+    args = parse_args(argv)
+
+    if args.clear_cache:
+        BuildCache(args.cache_dir).clear()
+        if not args.paths:
+            return
+
+    if args.paths == [STDIO]:
+        assemble_stdin(args)
+        return
+
+    start = time.perf_counter()
+    files = find_files(args.paths)
+    if len(files) == 1 or args.jobs <= 1:
+        results = [assemble_job(path, args) for path in files]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            #map keeps the results in the order of files, however the work is scheduled
+            results = list(pool.map(assemble_job, files, [args] * len(files)))
+    elapsed = time.perf_counter() - start
+
+    failures = [result for result in results if result[4] is not None]
+    for path, write_file, seconds, saved, error in results:
+        if error is None and saved is not None:
+            print('created file {file} ({ms:.1f} ms, optimizer saved {saved} instructions)'.format(
+                file=write_file,
+                ms=seconds * 1000,
+                saved=saved))
+        elif error is None:
+            print('created file {file} ({ms:.1f} ms)'.format(file=write_file, ms=seconds * 1000))
+        else:
+            print('failed {file}: {error}'.format(file=path, error=error))
+    if len(files) > 1:
+        print('assembled {done} of {total} files in {ms:.1f} ms'.format(
+            done=len(files) - len(failures),
+            total=len(files),
+            ms=elapsed * 1000))
+    if failures:
+        sys.exit(1)
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv[1:])
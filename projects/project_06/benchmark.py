@@ -0,0 +1,225 @@
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import Assembler
+
+'''
+Measures the performance of the assembler on a fixed set of workloads:
+    pong        the generated pong/Pong.asm and pong/PongL.asm programs
+    full_rom    synthetic programs that fill the whole 32K ROM
+    symbols     synthetic programs with thousands of labels and variables
+
+Every workload is timed phase by phase (parse, symbols, encode, write) and the best of
+several repeats is kept. Throughput is reported in source lines per second and peak
+memory is traced in a separate run, so tracing does not slow the timed runs.
+Each run appends one JSON record to the output file, so results can be compared over time.
+'''
+
+ROM_SIZE = 32768
+#kept next to this script, so results accumulate in one place whatever the working directory
+DEFAULT_OUTPUT = Path(__file__).resolve().parent.joinpath('benchmark_results.jsonl')
+PONG = ['pong/Pong.asm', 'pong/PongL.asm']
+COMPUTATIONS = ['D=M', 'M=D', 'D=A', 'AM=M-1', 'M=M+1', 'D=D+A', 'M=D+M', 'A=M', 'D=M-D', 'M=!M']
+JUMPS = ['D;JEQ', 'D;JGT', 'D;JLT', 'D;JNE', '0;JMP']
+
+def full_rom_program(seed):
+    '''
+    Returns the lines of a program of ROM_SIZE instructions shaped like translated VM code:
+    mostly predefined-symbol and constant A-commands and C-commands, a label every few
+    dozen instructions, and jumps to labels both before and after them
+    '''
+    rng = random.Random(seed)
+    lines = []
+    labels = 0
+    instructions = 0
+    while instructions < ROM_SIZE - 2:
+        if rng.random() < 0.03:
+            lines.append('(BLOCK{num})'.format(num=labels))
+            labels += 1
+            continue
+        if rng.random() < 0.05:
+            target = rng.randrange(labels + 50)
+            lines.append('@BLOCK{num}'.format(num=target))
+            lines.append(rng.choice(JUMPS))
+        elif rng.random() < 0.5:
+            lines.append(rng.choice(['@SP', '@LCL', '@ARG', '@THIS', '@THAT', '@R13', '@{num}'.format(num=rng.randrange(256))]))
+            lines.append(rng.choice(COMPUTATIONS))
+        else:
+            lines.append(rng.choice(COMPUTATIONS) + '   // comment')
+            lines.append(rng.choice(COMPUTATIONS))
+        instructions += 2
+    #define any label that was jumped to but not reached
+    for num in range(labels, labels + 50):
+        lines.append('(BLOCK{num})'.format(num=num))
+    return lines
+
+def symbol_heavy_program(seed, labels=4000, variables=4000):
+    '''
+    Returns the lines of a program that defines the given number of labels and uses the
+    given number of variables, each referenced from several places
+    '''
+    rng = random.Random(seed)
+    lines = []
+    for num in range(labels):
+        lines.append('(LABEL_{num})'.format(num=num))
+        lines.append('@var_{num}'.format(num=rng.randrange(variables)))
+        lines.append('D=M')
+        lines.append('@LABEL_{num}'.format(num=rng.randrange(labels)))
+        lines.append('D;JNE')
+    for num in range(variables):
+        lines.append('@var_{num}'.format(num=num))
+        lines.append('M=D')
+    return lines
+
+def measure(path, repeat, backend):
+    '''
+    Returns the timings, throughput, and peak memory of assembling the file at path
+    '''
+    with open(path, 'r') as file:
+        source_lines = sum(1 for _ in file)
+    if backend == Assembler.NUMPY_BACKEND:
+        import numpy_backend
+        write_words = numpy_backend.write_words
+        mode = 'wb'
+    else:
+        write_words = Assembler.write_words
+        mode = 'w'
+
+    phases = {}
+    out_dir = tempfile.mkdtemp()
+    out_name = Path(out_dir).joinpath('out.hack')
+    for _ in range(repeat):
+        times = {}
+        start = time.perf_counter()
+        with open(path, 'r') as file:
+            instructions = Assembler.decode_program(file)
+        times['parse'] = time.perf_counter() - start
+
+        symbol_table = Assembler.SymbolTable()
+        start = time.perf_counter()
+        Assembler.collect_labels(instructions, symbol_table)
+        times['symbols'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        words = list(Assembler.encode_instructions(instructions, symbol_table))
+        times['encode'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(out_name, mode) as outfile:
+            write_words(words, outfile)
+        times['write'] = time.perf_counter() - start
+
+        for phase, seconds in times.items():
+            phases[phase] = min(phases.get(phase, seconds), seconds)
+        #the decode cache would otherwise make every repeat after the first cheaper
+        Assembler.decode.cache_clear()
+
+    tracemalloc.start()
+    with open(path, 'r') as file:
+        instructions = Assembler.decode_program(file)
+    symbol_table = Assembler.SymbolTable()
+    Assembler.collect_labels(instructions, symbol_table)
+    words = list(Assembler.encode_instructions(instructions, symbol_table))
+    with open(out_name, mode) as outfile:
+        write_words(words, outfile)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    Assembler.decode.cache_clear()
+    out_name.unlink()
+    Path(out_dir).rmdir()
+
+    total = sum(phases.values())
+    return {
+        'lines' : source_lines,
+        'instructions' : len(words),
+        'seconds' : {phase : round(seconds, 6) for phase, seconds in phases.items()},
+        'total_seconds' : round(total, 6),
+        'lines_per_second' : round(source_lines / total),
+        'peak_memory_bytes' : peak
+    }
+
+def workloads(directory, seed):
+    '''
+    Returns (name, path) for every workload, writing the synthetic programs into directory
+    '''
+    base = Path(__file__).parent
+    result = [('pong/' + Path(name).name, base.joinpath(name)) for name in PONG]
+    synthetic = [
+        ('full_rom', full_rom_program(seed)),
+        ('symbols', symbol_heavy_program(seed))
+    ]
+    for name, lines in synthetic:
+        path = Path(directory).joinpath(name + Assembler.ASM)
+        with open(path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        result.append((name, path))
+    return result
+
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError('must be at least 1, not {value}'.format(value=value))
+    return value
+
+def parse_args(args):
+    usage = 'Benchmarks the assembler and appends the results to a JSON lines file'
+    parser = argparse.ArgumentParser(usage=usage)
+
+    #optional arguments
+    parser.add_argument('-o', '--output',
+        default=DEFAULT_OUTPUT,
+        help='the file the results are appended to')
+    parser.add_argument('-r', '--repeat',
+        default=5,
+        type=positive_int,
+        help='how many times each workload is timed; the best time is kept')
+    parser.add_argument('-b', '--backend',
+        default=Assembler.PYTHON_BACKEND,
+        choices=[Assembler.PYTHON_BACKEND, Assembler.NUMPY_BACKEND],
+        help='the backend used for the write phase')
+    parser.add_argument('--seed',
+        default=0,
+        type=int,
+        help='the seed the synthetic programs are generated from')
+    return parser.parse_args(args)
+
+def main(argv):
+    args = parse_args(argv)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, path in workloads(directory, args.seed):
+            result = measure(path, args.repeat, args.backend)
+            results[name] = result
+            print('{name:<16} {lines:>7} lines  {rate:>9} lines/s  parse {parse:.1f} ms  symbols {symbols:.1f} ms  encode {encode:.1f} ms  write {write:.1f} ms  peak {peak:.1f} MiB'.format(
+                name=name,
+                lines=result['lines'],
+                rate=result['lines_per_second'],
+                parse=result['seconds']['parse'] * 1000,
+                symbols=result['seconds']['symbols'] * 1000,
+                encode=result['seconds']['encode'] * 1000,
+                write=result['seconds']['write'] * 1000,
+                peak=result['peak_memory_bytes'] / (1024 * 1024)))
+
+    record = {
+        'timestamp' : time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'assembler_version' : Assembler.ASSEMBLER_VERSION,
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'backend' : args.backend,
+        'repeat' : args.repeat,
+        'seed' : args.seed,
+        'workloads' : results
+    }
+    with open(args.output, 'a') as file:
+        file.write(json.dumps(record) + '\n')
+    print('appended results to {file}'.format(file=args.output))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,175 @@
+import sys
+
+from emulator import Emulator, ROM_SIZE, ADDRESS_MASK, CONDITIONS, alu_expression, run_cli
+
+'''
+Runs Hack programs a basic block at a time. A block is the straight-line run of
+instructions from an entry address up to and including the first conditional or
+indirect jump, continuing through any 0;JMP to a known address. Each block is translated
+into the source of one Python function, compiled once, and cached by its entry address.
+Executing a program then chains whole blocks instead of dispatching on every instruction.
+
+Within a block the value of A is tracked at translation time, so @Xxx followed by M
+becomes a direct ram[Xxx] access. Jump targets only known at run time, such as the
+A=M;JMP that VMTranslator.write_return emits, simply end their block: whichever address
+they reach is looked up in the cache, and its block is compiled on first use. When fewer
+cycles are left than a block holds, the remaining instructions are interpreted one at a
+time, so runs stop after exactly the requested number of instructions.
+'''
+
+#the most instructions translated into a single block
+BLOCK_LIMIT = 256
+USAGE = 'Runs a .hack or .hackp program a compiled basic block at a time'
+
+def block_source(rom, start, halts):
+    '''
+    Returns the source of a function block(a, d) -> (a, d, pc) executing the block that
+    starts at address start, and the number of instructions it executes
+    '''
+    lines = ['def block(a, d):']
+    known = None
+    address = start
+    length = 0
+    while True:
+        word = rom[address] if address < len(rom) else 0
+        address += 1
+        length += 1
+        if not word & 0x8000:
+            lines.append('    a = {value}'.format(value=word))
+            known = word
+        else:
+            if word & 0x1000:
+                y = 'ram[{address}]'.format(address=known & 0x7FFF) if known is not None else 'ram[a & 32767]'
+            else:
+                y = str(known) if known is not None else 'a'
+            expression = alu_expression((word >> 6) & 0b111111).replace('y', y)
+            target = str(known & 0x7FFF) if known is not None else 'target'
+            jump = word & 0b111
+            writes_a = word & 0b100000
+            writes_d = word & 0b010000
+            writes_m = word & 0b001000
+
+            if jump and known is None:
+                #the jump goes to A as it was before this instruction
+                lines.append('    target = a & 32767')
+            conditional = jump and jump != 0b111
+            if not conditional and [writes_a, writes_d, writes_m].count(0) == 2:
+                #a single destination needs no temporary
+                if writes_m:
+                    lines.append('    ram[{address}] = {expression}'.format(
+                        address=known & 0x7FFF if known is not None else 'a & 32767',
+                        expression=expression))
+                elif writes_d:
+                    lines.append('    d = {expression}'.format(expression=expression))
+                else:
+                    lines.append('    a = {expression}'.format(expression=expression))
+            elif conditional or writes_a or writes_d or writes_m:
+                lines.append('    out = {expression}'.format(expression=expression))
+                if writes_m:
+                    lines.append('    ram[{address}] = out'.format(
+                        address=known & 0x7FFF if known is not None else 'a & 32767'))
+                if writes_a:
+                    lines.append('    a = out')
+                if writes_d:
+                    lines.append('    d = out')
+            if jump == 0b111 and known is not None and length < BLOCK_LIMIT:
+                #follow a jump to a known address and keep translating there
+                address = known & 0x7FFF
+            elif jump == 0b111:
+                lines.append('    return a, d, {target}'.format(target=target))
+                break
+            elif jump:
+                lines.append('    if {condition}:'.format(condition=CONDITIONS[jump]))
+                lines.append('        return a, d, {target}'.format(target=target))
+                lines.append('    return a, d, {address}'.format(address=address & ADDRESS_MASK))
+                break
+            if writes_a:
+                known = None
+        if address in halts or address >= ROM_SIZE or length >= BLOCK_LIMIT:
+            lines.append('    return a, d, {address}'.format(address=address & ADDRESS_MASK))
+            break
+    return '\n'.join(lines), length
+
+class BlockEmulator(Emulator):
+    '''
+    An Emulator that executes compiled basic blocks, falling back to the per-instruction
+    operations of Emulator only to finish a run partway through a block
+    '''
+
+    def __init__(self, words):
+        super().__init__(words)
+        self.blocks = [None] * ROM_SIZE
+        self.namespace = {'ram' : self.ram}
+
+    def compile_block(self, start):
+        '''
+        Translates, compiles and caches the block entered at address start
+        '''
+        source, length = block_source(self.rom, start, self.halts)
+        exec(compile(source, '<hack block {start}>'.format(start=start), 'exec'), self.namespace)
+        block = (self.namespace.pop('block'), length)
+        self.blocks[start] = block
+        return block
+
+    def execute(self, cycles, stop_at_halt):
+        '''
+        Executes up to cycles instructions, stopping early at the final loop if asked.
+        Returns the number executed.
+        '''
+        blocks = self.blocks
+        halts = self.halts if stop_at_halt else ()
+        a = self.a
+        d = self.d
+        pc = self.pc
+        remaining = cycles
+        while remaining and pc not in halts:
+            block = blocks[pc]
+            if block is None:
+                block = self.compile_block(pc)
+            function, length = block
+            if length > remaining:
+                break
+            a, d, pc = function(a, d)
+            remaining -= length
+
+        #finish partway through a block one instruction at a time
+        ops = self.ops
+        while remaining and pc not in halts:
+            op = ops[pc]
+            if op.__class__ is int:
+                a = op
+                pc = (pc + 1) & ADDRESS_MASK
+            else:
+                a, d, pc = op(a, d, pc)
+            remaining -= 1
+
+        self.a = a
+        self.d = d
+        self.pc = pc
+        self.cycles += cycles - remaining
+        return cycles - remaining
+
+    def run(self, cycles):
+        '''
+        Executes exactly the given number of instructions
+        '''
+        return self.execute(cycles, False)
+
+    def run_until_halt(self, max_cycles):
+        '''
+        Executes instructions until the program reaches its final @Xxx 0;JMP loop, but
+        never more than max_cycles of them. Returns the number executed.
+        '''
+        return self.execute(max_cycles, True)
+
+    def details(self):
+        '''
+        Returns the number of blocks compiled, for the report of a run
+        '''
+        return ', {blocks} blocks compiled'.format(blocks=sum(1 for block in self.blocks if block is not None))
+
+def main(argv):
+    run_cli(argv, BlockEmulator, USAGE)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
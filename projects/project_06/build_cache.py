@@ -0,0 +1,127 @@
+import os
+import struct
+import hashlib
+import tempfile
+from pathlib import Path
+
+import packed_hack
+
+'''
+An on-disk cache of assembled programs. Each entry is keyed by a hash of the assembler
+version and the contents of the .asm file, and holds the encoded instructions in the
+packed format, so a hit hands the program back without parsing it again. After the
+words, which packed readers ignore, each entry holds a signed 32 bit count of the
+instructions the optimizer saved, or -1 when it did not run.
+The cache is bounded in size: when it grows past its limit the least recently used
+entries are evicted. Every hit refreshes the modification time of its entry, which is
+what recency is measured by.
+'''
+
+DEFAULT_DIRECTORY = Path.home().joinpath('.cache', 'hack_assembler')
+DEFAULT_SIZE = 64 * 1024 * 1024
+READ_SIZE = 1 << 16
+TRAILER = struct.Struct('<i')
+
+class BuildCache:
+    '''
+    A size-bounded, least recently used cache of assembled programs
+    '''
+
+    def __init__(self, directory=None, max_size=DEFAULT_SIZE):
+        self.directory = Path(directory) if directory else DEFAULT_DIRECTORY
+        self.max_size = max_size
+
+    def key(self, file_name, version):
+        '''
+        Returns the cache key for the contents of file_name assembled by the given assembler version
+        '''
+        digest = hashlib.sha256(str(version).encode())
+        digest.update(b'\0')
+        with open(file_name, 'rb') as file:
+            for chunk in iter(lambda: file.read(READ_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def entry(self, key):
+        return self.directory.joinpath(key + packed_hack.PACKED)
+
+    def get(self, key):
+        '''
+        Returns the cached instruction words for key and the instructions the optimizer saved
+        on them, which is None if it did not run, or (None, None) if they are not cached
+        '''
+        entry = self.entry(key)
+        try:
+            with packed_hack.load_packed(entry) as program:
+                words = list(program)
+                saved, = TRAILER.unpack_from(program.map, packed_hack.HEADER.size + len(words) * 2)
+            os.utime(entry)
+        except (OSError, ValueError, struct.error):
+            #missing, evicted while being read, or corrupt: treat all of them as a miss
+            return None, None
+        return words, None if saved < 0 else saved
+
+    def put(self, key, words, saved=None):
+        '''
+        Stores the instruction words, and the instructions the optimizer saved on them, under key,
+        then evicts entries until the cache fits its size limit. Like get, it never fails:
+        a cache that cannot be written to is simply left as it is
+        '''
+        temp_name = None
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            #write to a temporary file first so readers never see a partial entry
+            handle, temp_name = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(handle, 'wb') as file:
+                packed_hack.write_packed(words, file)
+                file.write(TRAILER.pack(-1 if saved is None else saved))
+            os.replace(temp_name, self.entry(key))
+            temp_name = None
+            self.evict()
+        except OSError:
+            if temp_name:
+                try:
+                    os.unlink(temp_name)
+                except OSError:
+                    pass
+
+    def entries(self):
+        '''
+        Returns (modification time, size, path) for every entry, least recently used first
+        '''
+        if not self.directory.is_dir():
+            return []
+        entries = []
+        for entry in self.directory.glob('*' + packed_hack.PACKED):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        '''
+        Removes least recently used entries until the cache is no larger than max_size
+        '''
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_size:
+                break
+            try:
+                entry.unlink()
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        '''
+        Removes every entry from the cache
+        '''
+        for _, _, entry in self.entries():
+            try:
+                entry.unlink()
+            except OSError:
+                continue
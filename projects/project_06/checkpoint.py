@@ -0,0 +1,214 @@
+import sys
+import mmap
+import zlib
+import time
+import struct
+import argparse
+from array import array
+
+import packed_hack
+from emulator import Emulator, RAM_SIZE, load_rom
+from block_emulator import BlockEmulator
+
+'''
+Saves and restores the full state of the Hack computer, so long runs of interactive
+programs such as Pong can resume from a checkpoint instead of replaying from boot.
+A snapshot holds a small header followed by all of RAM as little-endian words:
+
+    offset 0    4 bytes   magic b'HSNP'
+    offset 4    uint16    format version
+    offset 6    uint16    A
+    offset 8    uint16    D
+    offset 10   uint16    PC
+    offset 12   uint32    CRC-32 of the ROM the snapshot was taken with
+    offset 16   uint64    instructions executed so far
+    offset 24   uint32    number of RAM words
+    offset 28   uint16[]  RAM
+
+Restoring memory-maps the snapshot and copies RAM straight from the mapping into the
+emulator. Keyboard input is replayed from a trace of lines "CYCLE KEY", which press KEY
+once the emulator has executed CYCLE instructions in total, counted from boot rather than
+from the checkpoint. KEY is a Hack character code, a single character, or the name of a
+special key such as left or space; 0 releases every key.
+'''
+
+MAGIC = b'HSNP'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHHIQI')
+SNAPSHOT = '.hsnp'
+
+#the Hack character set codes of the keys that are not printable characters
+KEYS = {
+    'space' : 32,
+    'newline' : 128,
+    'enter' : 128,
+    'backspace' : 129,
+    'left' : 130,
+    'up' : 131,
+    'right' : 132,
+    'down' : 133,
+    'home' : 134,
+    'end' : 135,
+    'pageup' : 136,
+    'pagedown' : 137,
+    'insert' : 138,
+    'delete' : 139,
+    'esc' : 140
+}
+KEYS.update({'f{num}'.format(num=num) : 140 + num for num in range(1, 13)})
+
+def rom_checksum(emulator):
+    return zlib.crc32(packed_hack.to_little_endian(emulator.rom).tobytes())
+
+def save(emulator, file_name):
+    '''
+    Writes the registers and RAM of the emulator to the snapshot file file_name
+    '''
+    with open(file_name, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, emulator.a, emulator.d, emulator.pc,
+            rom_checksum(emulator), emulator.cycles, len(emulator.ram)))
+        file.write(packed_hack.to_little_endian(emulator.ram).tobytes())
+
+def restore(emulator, file_name):
+    '''
+    Loads the registers and RAM of the emulator from the snapshot file file_name, which
+    must have been taken with the same program in ROM
+    '''
+    with open(file_name, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as snapshot:
+        magic, version, a, d, pc, checksum, cycles, count = HEADER.unpack_from(snapshot)
+        assert magic == MAGIC, '{file} is not a hack snapshot'.format(file=file_name)
+        assert version == VERSION, 'unsupported snapshot version {version}'.format(version=version)
+        assert checksum == rom_checksum(emulator), '{file} was taken with a different program'.format(file=file_name)
+        assert count == RAM_SIZE, '{file} holds {count} RAM words, not {size}'.format(file=file_name, count=count, size=RAM_SIZE)
+        end = HEADER.size + count * 2
+        assert len(snapshot) >= end, '{file} is truncated'.format(file=file_name)
+        #RAM is updated in place, since the decoded operations of the emulator refer to it
+        with memoryview(snapshot)[HEADER.size:end] as view:
+            if sys.byteorder == 'little':
+                with view.cast('H') as words:
+                    memoryview(emulator.ram)[:] = words
+            else:
+                words = array('H', view.tobytes())
+                words.byteswap()
+                emulator.ram[:] = words
+    emulator.a = a
+    emulator.d = d
+    emulator.pc = pc
+    emulator.cycles = cycles
+
+def parse_key(text):
+    '''
+    Returns the Hack character code of a key given by code, character or name
+    '''
+    if text.lower() in KEYS:
+        return KEYS[text.lower()]
+    if text.isdigit():
+        return int(text)
+    assert len(text) == 1, 'unknown key {key}'.format(key=text)
+    return ord(text)
+
+def read_trace(file_name):
+    '''
+    Returns the (cycle, key) events of a keyboard trace file, ordered by cycle
+    '''
+    events = []
+    with open(file_name, 'r') as file:
+        for line in file:
+            line = line.split('//')[0].strip()
+            if not line:
+                continue
+            cycle, key = line.split(None, 1)
+            events.append((int(cycle), parse_key(key.strip())))
+    events.sort(key=lambda event: event[0])
+    return events
+
+def write_trace(events, file_name):
+    '''
+    Writes (cycle, key) events to a keyboard trace file
+    '''
+    with open(file_name, 'w') as file:
+        for cycle, key in events:
+            file.write('{cycle} {key}\n'.format(cycle=cycle, key=key))
+
+def replay(emulator, events, cycles):
+    '''
+    Runs the emulator until it has executed cycles instructions in total, pressing the
+    key of every event once its cycle is reached. Events before the current cycle are
+    skipped, except that the last of them sets the key held down at the start.
+    '''
+    held = None
+    for cycle, key in events:
+        if cycle > cycles:
+            break
+        if cycle <= emulator.cycles:
+            held = key
+            continue
+        if held is not None:
+            emulator.set_key(held)
+            held = None
+        emulator.run(cycle - emulator.cycles)
+        emulator.set_key(key)
+    if held is not None:
+        emulator.set_key(held)
+    if cycles > emulator.cycles:
+        emulator.run(cycles - emulator.cycles)
+
+def parse_args(args):
+    usage = 'Runs a .hack or .hackp program from boot or a snapshot, replaying keyboard input and saving a snapshot'
+    parser = argparse.ArgumentParser(usage=usage)
+
+    #positional arguments
+    parser.add_argument('path',
+        nargs=1,
+        help='the program to run')
+
+    #optional arguments
+    parser.add_argument('-c', '--cycles',
+        default=1000000,
+        type=int,
+        help='the total instructions executed, counted from boot, to run until')
+    parser.add_argument('-l', '--load',
+        default=None,
+        help='a snapshot to start from instead of booting')
+    parser.add_argument('-o', '--save',
+        default=None,
+        help='the file to save a snapshot to after running')
+    parser.add_argument('-t', '--trace',
+        default=None,
+        help='a keyboard trace to replay')
+    parser.add_argument('-r', '--ram',
+        default=[],
+        action='append',
+        type=int,
+        help='a RAM address to print after running; may be repeated')
+    parser.add_argument('-i', '--interpret',
+        default=False,
+        action='store_true',
+        help='interpret instruction by instruction instead of running compiled blocks')
+    return parser.parse_args(args)
+
+def main(argv):
+    args = parse_args(argv)
+    words = load_rom(args.path[0])
+    emulator = Emulator(words) if args.interpret else BlockEmulator(words)
+    if args.load:
+        restore(emulator, args.load)
+    events = read_trace(args.trace) if args.trace else []
+
+    start = time.perf_counter()
+    first = emulator.cycles
+    replay(emulator, events, args.cycles)
+    elapsed = time.perf_counter() - start
+    print('ran from cycle {first} to {last} in {ms:.1f} ms'.format(
+        first=first,
+        last=emulator.cycles,
+        ms=elapsed * 1000))
+
+    if args.save:
+        save(emulator, args.save)
+        print('saved snapshot to {file}'.format(file=args.save))
+    for address in args.ram:
+        print('RAM[{address}] = {value}'.format(address=address, value=emulator.peek(address)))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
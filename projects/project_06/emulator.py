@@ -0,0 +1,326 @@
+import sys
+import time
+import argparse
+import functools
+from array import array
+from pathlib import Path
+
+import packed_hack
+from Assembler import PREDEFINED_SYMBOLS
+
+'''
+Runs Hack machine code. Every ROM word is decoded once, when the program is loaded,
+into a pre-dispatched operation: A-instructions become the plain int to load into A,
+and each distinct C-instruction becomes a small generated Python function that computes
+its ALU output, stores it, and returns the new (A, D, PC). The interpreter loop then only
+has to tell the two apart. RAM is a typed array of unsigned 16 bit words, with the screen
+and keyboard memory maps where Assembler.SymbolTable puts SCREEN and KBD.
+'''
+
+ROM_SIZE = 32768
+RAM_SIZE = 32768
+#memory addresses are the low 15 bits of A
+ADDRESS_MASK = 0x7FFF
+WORD_MASK = 0xFFFF
+SCREEN = PREDEFINED_SYMBOLS['SCREEN']
+KBD = PREDEFINED_SYMBOLS['KBD']
+SCREEN_SIZE = KBD - SCREEN
+USAGE = 'Runs a .hack or .hackp program on the Hack computer for a bounded number of cycles'
+
+#ALU expressions for the comp field (c1..c6) of every assembler mnemonic, with y standing
+#for A or M depending on the a-bit
+COMPUTATIONS = {
+    0b101010 : '0',
+    0b111111 : '1',
+    0b111010 : '65535',
+    0b001100 : 'd',
+    0b110000 : 'y',
+    0b001101 : 'd ^ 65535',
+    0b110001 : 'y ^ 65535',
+    0b001111 : '-d & 65535',
+    0b110011 : '-y & 65535',
+    0b011111 : '(d + 1) & 65535',
+    0b110111 : '(y + 1) & 65535',
+    0b001110 : '(d - 1) & 65535',
+    0b110010 : '(y - 1) & 65535',
+    0b000010 : '(d + y) & 65535',
+    0b010011 : '(d - y) & 65535',
+    0b000111 : '(y - d) & 65535',
+    0b000000 : 'd & y',
+    0b010101 : 'd | y'
+}
+
+#conditions on the ALU output for each jump field, treating it as a signed 16 bit number
+CONDITIONS = {
+    0b001 : '0 < out < 32768',
+    0b010 : 'out == 0',
+    0b011 : 'out < 32768',
+    0b100 : 'out >= 32768',
+    0b101 : 'out != 0',
+    0b110 : 'out == 0 or out >= 32768'
+}
+
+def alu_expression(comp):
+    '''
+    Returns the expression for any 6 bit comp field, following the zx/nx/zy/ny/f/no
+    steps of the ALU for those the assembler has no mnemonic for
+    '''
+    if comp in COMPUTATIONS:
+        return COMPUTATIONS[comp]
+    x = '0' if comp & 0b100000 else 'd'
+    if comp & 0b010000:
+        x = '({x} ^ 65535)'.format(x=x)
+    y = '0' if comp & 0b001000 else 'y'
+    if comp & 0b000100:
+        y = '({y} ^ 65535)'.format(y=y)
+    if comp & 0b000010:
+        out = '(({x} + {y}) & 65535)'.format(x=x, y=y)
+    else:
+        out = '({x} & {y})'.format(x=x, y=y)
+    if comp & 0b000001:
+        out = '({out} ^ 65535)'.format(out=out)
+    return out
+
+def c_instruction_source(word):
+    '''
+    Returns the source of a function op(a, d, pc) -> (a, d, pc) executing the C-instruction word
+    '''
+    y = 'ram[a & 32767]' if word & 0x1000 else 'a'
+    expression = alu_expression((word >> 6) & 0b111111).replace('y', y)
+    lines = ['def op(a, d, pc):', '    out = {expression}'.format(expression=expression)]
+    if word & 0b001000:
+        lines.append('    ram[a & 32767] = out')
+    jump = word & 0b111
+    #the jump reads A before this instruction updates it, as the hardware does
+    if jump == 0b111:
+        target = 'a & 32767'
+    elif jump:
+        target = '(a & 32767) if {condition} else (pc + 1) & 32767'.format(condition=CONDITIONS[jump])
+    else:
+        #the 15 bit PC wraps around past the end of ROM
+        target = '(pc + 1) & 32767'
+    lines.append('    return {a}, {d}, {target}'.format(
+        a='out' if word & 0b100000 else 'a',
+        d='out' if word & 0b010000 else 'd',
+        target=target))
+    return '\n'.join(lines)
+
+@functools.lru_cache(maxsize=None)
+def compile_c_instruction(word):
+    '''
+    Returns the compiled code of the function for the C-instruction word
+    '''
+    return compile(c_instruction_source(word), '<hack {word:016b}>'.format(word=word), 'exec')
+
+def load_rom(file_name):
+    '''
+    Returns the instruction words of a textual .hack or packed .hackp file
+    '''
+    if Path(file_name).suffix == packed_hack.PACKED:
+        with packed_hack.load_packed(file_name) as program:
+            return list(program)
+    return packed_hack.read_text(file_name)
+
+class Emulator:
+    '''
+    The Hack computer: a CPU with its A, D and PC registers, a 32K ROM holding the program,
+    and a 32K RAM with the screen and keyboard mapped into it
+    '''
+
+    def __init__(self, words):
+        '''
+        Loads the instruction words into ROM and decodes each of them once
+        '''
+        assert len(words) <= ROM_SIZE, 'the program does not fit in the 32K ROM'
+        self.rom = array('H', words)
+        self.ram = array('H', bytes(2 * RAM_SIZE))
+        self.ops = self.decode(self.rom)
+        self.halts = self.find_halts(self.rom)
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+
+    def decode(self, rom):
+        '''
+        Returns the pre-dispatched operation of every ROM address. Addresses past the
+        program hold 0, which like an empty ROM word loads 0 into A.
+        '''
+        namespace = {'ram' : self.ram}
+        functions = {}
+        ops = [0] * ROM_SIZE
+        for address, word in enumerate(rom):
+            if word & 0x8000:
+                if word not in functions:
+                    exec(compile_c_instruction(word), namespace)
+                    functions[word] = namespace.pop('op')
+                ops[address] = functions[word]
+            else:
+                ops[address] = word
+        return ops
+
+    def find_halts(self, rom):
+        '''
+        Returns the addresses of the @Xxx that start an (Xxx) @Xxx 0;JMP loop, the
+        idiomatic way Hack programs end
+        '''
+        halts = set()
+        for address in range(len(rom) - 1):
+            if rom[address] == address and rom[address + 1] == 0b1110101010000111:
+                halts.add(address)
+        return halts
+
+    def reset(self):
+        '''
+        Restarts the program from ROM[0], keeping the contents of RAM
+        '''
+        self.pc = 0
+
+    def run(self, cycles):
+        '''
+        Executes exactly the given number of instructions
+        '''
+        ops = self.ops
+        a = self.a
+        d = self.d
+        pc = self.pc
+        for _ in range(cycles):
+            op = ops[pc]
+            if op.__class__ is int:
+                a = op
+                pc = (pc + 1) & ADDRESS_MASK
+            else:
+                a, d, pc = op(a, d, pc)
+        self.a = a
+        self.d = d
+        self.pc = pc
+        self.cycles += cycles
+        return cycles
+
+    def run_until_halt(self, max_cycles):
+        '''
+        Executes instructions until the program reaches its final @Xxx 0;JMP loop, but
+        never more than max_cycles of them. Returns the number executed.
+        '''
+        ops = self.ops
+        halts = self.halts
+        a = self.a
+        d = self.d
+        pc = self.pc
+        executed = 0
+        while executed < max_cycles and pc not in halts:
+            op = ops[pc]
+            if op.__class__ is int:
+                a = op
+                pc = (pc + 1) & ADDRESS_MASK
+            else:
+                a, d, pc = op(a, d, pc)
+            executed += 1
+        self.a = a
+        self.d = d
+        self.pc = pc
+        self.cycles += executed
+        return executed
+
+    def halted(self):
+        '''
+        Has the program reached its final loop?
+        '''
+        return self.pc in self.halts
+
+    def details(self):
+        '''
+        Returns any details of the emulator to add to the report of a run
+        '''
+        return ''
+
+    def peek(self, address):
+        '''
+        Returns RAM[address] as a signed number
+        '''
+        value = self.ram[address]
+        return value - 0x10000 if value & 0x8000 else value
+
+    def poke(self, address, value):
+        '''
+        Sets RAM[address]; negative values are stored in two's complement
+        '''
+        self.ram[address] = value & WORD_MASK
+
+    def set_key(self, key):
+        '''
+        Presses the key with the given Hack character code, or releases all keys for 0
+        '''
+        self.ram[KBD] = key & WORD_MASK
+
+    def screen(self):
+        '''
+        Returns a view of the 8K words of the screen memory map
+        '''
+        return memoryview(self.ram)[SCREEN:KBD]
+
+def parse_assignment(text):
+    address, value = text.split('=')
+    return int(address), int(value)
+
+def parse_args(args, usage=USAGE):
+    parser = argparse.ArgumentParser(usage=usage)
+
+    #positional arguments
+    parser.add_argument('path',
+        nargs=1,
+        help='the program to run')
+
+    #optional arguments
+    parser.add_argument('-c', '--cycles',
+        default=1000000,
+        type=int,
+        help='the most instructions to execute')
+    parser.add_argument('-s', '--set',
+        dest='assignments',
+        default=[],
+        action='append',
+        type=parse_assignment,
+        help='ADDRESS=VALUE to store in RAM before running; may be repeated')
+    parser.add_argument('-r', '--ram',
+        default=[],
+        action='append',
+        type=int,
+        help='a RAM address to print after running; may be repeated')
+    parser.add_argument('--no-halt',
+        dest='halt',
+        default=True,
+        action='store_false',
+        help='keep running through the final @Xxx 0;JMP loop')
+    return parser.parse_args(args)
+
+def run_cli(argv, emulator_class, usage):
+    '''
+    Runs the program given on the command line argv on an emulator_class and reports the run
+    '''
+    args = parse_args(argv, usage)
+    emulator = emulator_class(load_rom(args.path[0]))
+    for address, value in args.assignments:
+        emulator.poke(address, value)
+
+    start = time.perf_counter()
+    if args.halt:
+        executed = emulator.run_until_halt(args.cycles)
+    else:
+        executed = emulator.run(args.cycles)
+    elapsed = time.perf_counter() - start
+
+    print('executed {cycles} instructions in {ms:.1f} ms ({rate:.2f} million per second{details}){halted}'.format(
+        cycles=executed,
+        ms=elapsed * 1000,
+        rate=executed / elapsed / 1e6 if elapsed else 0,
+        details=emulator.details(),
+        halted=', halted' if emulator.halted() else ''))
+    for address in args.ram:
+        print('RAM[{address}] = {value}'.format(address=address, value=emulator.peek(address)))
+
+def main(argv):
+    run_cli(argv, Emulator, USAGE)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
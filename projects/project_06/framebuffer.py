@@ -0,0 +1,173 @@
+import sys
+import zlib
+import time
+import struct
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from emulator import SCREEN, KBD, SCREEN_SIZE, load_rom
+from block_emulator import BlockEmulator
+
+'''
+Exports the Hack screen as images. The screen is 256 rows of 32 words at SCREEN, and
+bit i of a word is pixel 16 * column + i of its row, 1 for black. Rather than reading
+pixels one at a time, the 8K screen words are viewed as little-endian bytes and unpacked
+in a single step into a 256x512 array. Frames are written as binary PGM, or as 1 bit
+grayscale PNG built with zlib, so no imaging library is needed.
+'''
+
+WIDTH = 512
+HEIGHT = 256
+PGM = '.pgm'
+PNG = '.png'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+WHITE = 255
+
+def screen_bits(ram):
+    '''
+    Returns the screen as a HEIGHT x WIDTH uint8 array of 1 for black and 0 for white.
+    ram is either the whole RAM or just the 8K screen words, as an array('H'), a memoryview
+    such as Emulator.screen(), or a NumPy array.
+    '''
+    words = np.asarray(ram, dtype=np.uint16)
+    if len(words) != SCREEN_SIZE:
+        words = words[SCREEN:KBD]
+    pixels = np.unpackbits(words.astype('<u2', copy=False).view(np.uint8), bitorder='little')
+    return pixels.reshape(HEIGHT, WIDTH)
+
+def screen_image(ram):
+    '''
+    Returns the screen as a HEIGHT x WIDTH grayscale image, 0 for black and 255 for white
+    '''
+    return (1 - screen_bits(ram)) * np.uint8(WHITE)
+
+def pgm_bytes(bits):
+    '''
+    Returns the screen bits as a binary PGM image
+    '''
+    header = 'P5\n{width} {height}\n{white}\n'.format(width=WIDTH, height=HEIGHT, white=WHITE).encode()
+    return header + ((1 - bits) * np.uint8(WHITE)).tobytes()
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+def png_bytes(bits, level=1):
+    '''
+    Returns the screen bits as a 1 bit grayscale PNG image
+    '''
+    #PNG samples are 1 for white, most significant bit first, each row led by a filter byte of 0
+    rows = np.zeros((HEIGHT, WIDTH // 8 + 1), dtype=np.uint8)
+    rows[:, 1:] = np.packbits(1 - bits, axis=1)
+    header = struct.pack('>IIBBBBB', WIDTH, HEIGHT, 1, 0, 0, 0, 0)
+    return (PNG_SIGNATURE
+        + png_chunk(b'IHDR', header)
+        + png_chunk(b'IDAT', zlib.compress(rows.tobytes(), level))
+        + png_chunk(b'IEND', b''))
+
+ENCODERS = {
+    PGM : pgm_bytes,
+    PNG : png_bytes
+}
+
+def write_frame(ram, file_name):
+    '''
+    Writes the screen in ram to file_name, as PGM or PNG depending on its suffix
+    '''
+    suffix = Path(file_name).suffix
+    assert suffix in ENCODERS, 'unsupported image format {suffix}'.format(suffix=suffix)
+    with open(file_name, 'wb') as file:
+        file.write(ENCODERS[suffix](screen_bits(ram)))
+
+class FrameWriter:
+    '''
+    Writes a sequence of screen frames to numbered files frame_000000.png, frame_000001.png, ...
+    in a directory, optionally skipping frames identical to the one before
+    '''
+
+    def __init__(self, directory, suffix=PNG, skip_repeats=False):
+        assert suffix in ENCODERS, 'unsupported image format {suffix}'.format(suffix=suffix)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.encode = ENCODERS[suffix]
+        self.suffix = suffix
+        self.skip_repeats = skip_repeats
+        self.previous = None
+        self.frames = 0
+
+    def write(self, ram):
+        '''
+        Writes the screen in ram as the next frame. Returns the path written, or None for a skipped repeat.
+        '''
+        words = np.array(ram, dtype=np.uint16)
+        if len(words) != SCREEN_SIZE:
+            words = words[SCREEN:KBD]
+        if self.skip_repeats and self.previous is not None and np.array_equal(words, self.previous):
+            return None
+        self.previous = words
+        path = self.directory.joinpath('frame_{num:06d}{suffix}'.format(num=self.frames, suffix=self.suffix))
+        with open(path, 'wb') as file:
+            file.write(self.encode(screen_bits(words)))
+        self.frames += 1
+        return path
+
+def record(emulator, writer, frames, cycles_per_frame):
+    '''
+    Runs the emulator for frames periods of cycles_per_frame instructions, writing the screen
+    after each one. Returns the number of frames written.
+    '''
+    written = 0
+    for _ in range(frames):
+        emulator.run(cycles_per_frame)
+        if writer.write(emulator.screen()) is not None:
+            written += 1
+    return written
+
+def parse_args(args):
+    usage = 'Runs a .hack or .hackp program and writes its screen as a sequence of image frames'
+    parser = argparse.ArgumentParser(usage=usage)
+
+    #positional arguments
+    parser.add_argument('path',
+        nargs=1,
+        help='the program to run')
+    parser.add_argument('directory',
+        nargs=1,
+        help='the directory the frames are written to')
+
+    #optional arguments
+    parser.add_argument('-n', '--frames',
+        default=100,
+        type=int,
+        help='how many frames to capture')
+    parser.add_argument('-c', '--cycles',
+        default=100000,
+        type=int,
+        help='the instructions executed between frames')
+    parser.add_argument('-f', '--format',
+        default=PNG,
+        choices=list(ENCODERS),
+        help='the image format of the frames')
+    parser.add_argument('-u', '--unique',
+        default=False,
+        action='store_true',
+        help='skip frames identical to the one before')
+    return parser.parse_args(args)
+
+def main(argv):
+    args = parse_args(argv)
+    emulator = BlockEmulator(load_rom(args.path[0]))
+    writer = FrameWriter(args.directory[0], args.format, args.unique)
+
+    start = time.perf_counter()
+    written = record(emulator, writer, args.frames, args.cycles)
+    elapsed = time.perf_counter() - start
+    print('wrote {written} of {frames} frames to {directory} in {ms:.1f} ms'.format(
+        written=written,
+        frames=args.frames,
+        directory=args.directory[0],
+        ms=elapsed * 1000))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
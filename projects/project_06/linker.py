@@ -0,0 +1,148 @@
+import sys
+import json
+import argparse
+from pathlib import Path
+
+import packed_hack
+
+'''
+Links relocatable Hack object files into a single program. Assembler -c writes one object
+file (.hobj) per .asm file; linking the objects in order gives the same .hack output as
+assembling the concatenation of their sources, so an unchanging library only has to be
+assembled once.
+
+An object file is a JSON document holding:
+    code        the instruction words, with the local offset of a label wherever one is used
+    labels      every (Xxx) defined in the file and its offset from the start of the file
+    relocations indexes into code whose word is a local label offset
+    references  symbols not defined in the file, in order of first use, with the indexes of
+                code that use them. Each resolves to a label exported by another object, or
+                failing that is a request for a variable.
+'''
+
+OBJECT = '.hobj'
+HACK = '.hack'
+TEXT_FORMAT = 'text'
+PACKED_FORMAT = 'packed'
+OBJECT_FORMAT = 'hack-object'
+VERSION = 1
+#address of the first variable, just past R0-R15
+FIRST_VARIABLE = 0x0010
+
+class ObjectFile:
+    '''
+    The relocatable output of assembling a single .asm file
+    '''
+
+    def __init__(self, code, labels, relocations, references):
+        self.code = code
+        self.labels = labels
+        self.relocations = relocations
+        self.references = references
+
+    def write(self, file_name):
+        '''
+        Saves the object to file_name
+        '''
+        with open(file_name, 'w') as file:
+            self.dump(file)
+
+    def dump(self, file):
+        '''
+        Writes the object to the open text file
+        '''
+        contents = {
+            'format' : OBJECT_FORMAT,
+            'version' : VERSION,
+            'code' : self.code,
+            'labels' : self.labels,
+            'relocations' : self.relocations,
+            'references' : [[symbol, indexes] for symbol, indexes in self.references.items()]
+        }
+        json.dump(contents, file, separators=(',', ':'))
+
+    @staticmethod
+    def read(file_name):
+        '''
+        Loads the object saved at file_name
+        '''
+        with open(file_name, 'r') as file:
+            contents = json.load(file)
+        assert contents.get('format') == OBJECT_FORMAT, '{file} is not a hack object file'.format(file=file_name)
+        assert contents['version'] == VERSION, 'unsupported object version {version}'.format(version=contents['version'])
+        references = {symbol : indexes for symbol, indexes in contents['references']}
+        return ObjectFile(contents['code'], contents['labels'], contents['relocations'], references)
+
+def link(objects):
+    '''
+    Returns the instruction words of the program made of the given objects, in order.
+    Each object's code is placed right after the previous one, its labels and relocations
+    are moved by that base address, and references are resolved to the exported labels.
+    References that no object exports are variables, allocated in order of first use.
+    '''
+    bases = []
+    labels = {}
+    base = 0
+    for obj in objects:
+        bases.append(base)
+        for label, offset in obj.labels.items():
+            assert label not in labels, 'label {label} is defined more than once'.format(label=label)
+            labels[label] = base + offset
+        base += len(obj.code)
+
+    variables = {}
+    next_var = FIRST_VARIABLE
+    words = []
+    for obj, base in zip(objects, bases):
+        code = list(obj.code)
+        for index in obj.relocations:
+            code[index] += base
+        for symbol, indexes in obj.references.items():
+            if symbol in labels:
+                address = labels[symbol]
+            else:
+                if symbol not in variables:
+                    variables[symbol] = next_var
+                    next_var += 1
+                address = variables[symbol]
+            for index in indexes:
+                code[index] = address
+        words.extend(code)
+    return words
+
+def parse_args(args):
+    usage = 'Links Hack object files produced by Assembler -c into a single program'
+    parser = argparse.ArgumentParser(usage=usage)
+
+    #positional arguments
+    parser.add_argument('paths',
+        nargs='+',
+        help='the object files to link, in program order')
+
+    #optional arguments
+    parser.add_argument('-o', '--output',
+        default=None,
+        help='the program to write; defaults to the first object with a .hack suffix')
+    parser.add_argument('-f', '--format',
+        default=TEXT_FORMAT,
+        choices=[TEXT_FORMAT, PACKED_FORMAT],
+        help='write textual .hack output or packed binary .hackp output')
+    return parser.parse_args(args)
+
+def main(argv):
+    args = parse_args(argv)
+    paths = [Path(path) for path in args.paths]
+    objects = [ObjectFile.read(path) for path in paths]
+    words = link(objects)
+
+    if args.format == PACKED_FORMAT:
+        write_name = args.output or paths[0].with_suffix(packed_hack.PACKED)
+        with open(write_name, 'wb') as outfile:
+            packed_hack.write_packed(words, outfile)
+    else:
+        write_name = args.output or paths[0].with_suffix(HACK)
+        packed_hack.write_text(words, write_name)
+    print('linked {files} into {output}'.format(files=[str(path) for path in paths], output=write_name))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,38 @@
+import numpy as np
+
+'''
+Bulk rendering of assembled programs with NumPy. Rather than formatting every
+instruction on its own, the whole program is resolved into one uint16 array whose
+bits are unpacked in a single step into a preallocated buffer of '0'/'1' characters.
+'''
+
+#one line of the textual .hack format: 16 binary digits and a newline
+LINE_WIDTH = 17
+
+def to_array(words):
+    '''
+    Returns the instruction words as a uint16 array
+    '''
+    if isinstance(words, np.ndarray):
+        return words.astype(np.uint16, copy=False)
+    if not isinstance(words, list):
+        words = list(words)
+    return np.array(words, dtype=np.uint16)
+
+def render_text(words):
+    '''
+    Returns the bytes of the textual .hack format for the given instruction words
+    '''
+    words = to_array(words)
+    #big-endian bytes so the most significant bit is unpacked first
+    bits = np.unpackbits(words.astype('>u2').view(np.uint8).reshape(-1, 2), axis=1)
+    lines = np.empty((len(words), LINE_WIDTH), dtype=np.uint8)
+    np.add(bits, ord('0'), out=lines[:, :16])
+    lines[:, 16] = ord('\n')
+    return lines.tobytes()
+
+def write_words(words, outfile):
+    '''
+    Writes the instruction words to the binary file outfile in the textual .hack format
+    '''
+    outfile.write(render_text(words))
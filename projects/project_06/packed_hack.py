@@ -0,0 +1,176 @@
+import sys
+import mmap
+import struct
+import argparse
+from array import array
+from pathlib import Path
+
+'''
+A packed binary alternative to the textual .hack format. Instead of 17 characters per
+instruction, a packed file holds a small header followed by every 16 bit instruction
+as a little-endian unsigned word:
+
+    offset 0    4 bytes   magic b'HACK'
+    offset 4    uint16    format version
+    offset 6    uint16    reserved, always 0
+    offset 8    uint32    number of instructions
+    offset 12   uint16[]  the instructions
+
+The loader memory-maps the file, so a full 32K word ROM is available without copying it.
+Packed files convert to and from the textual format, which the .tst/.cmp workflows use.
+'''
+
+MAGIC = b'HACK'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+WORD = 'H'
+HACK = '.hack'
+PACKED = '.hackp'
+
+def to_little_endian(words):
+    '''
+    Returns the words as an array laid out in little-endian byte order
+    '''
+    words = array(WORD, words)
+    if sys.byteorder != 'little':
+        words.byteswap()
+    return words
+
+def write_packed(words, outfile):
+    '''
+    Writes the given instruction words to the binary file outfile in the packed format
+    '''
+    words = to_little_endian(words)
+    outfile.write(HEADER.pack(MAGIC, VERSION, 0, len(words)))
+    outfile.write(words.tobytes())
+
+class PackedProgram:
+    '''
+    A read-only, memory-mapped view of the instructions in a packed file.
+    Supports len(), indexing and iteration over the instruction words.
+    '''
+
+    def __init__(self, file_name):
+        '''
+        Maps the packed file at file_name and validates its header
+        '''
+        self.file = open(file_name, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.file.close()
+            raise
+        try:
+            self.words = self.validate(file_name)
+        except (ValueError, struct.error):
+            self.map.close()
+            self.file.close()
+            raise
+
+    def validate(self, file_name):
+        '''
+        Checks the header of the mapped file and returns a view of its instruction words,
+        raising ValueError if the file is not a complete packed file
+        '''
+        magic, version, _, count = HEADER.unpack_from(self.map)
+        #raised rather than asserted, so the checks still run under python -O
+        if magic != MAGIC:
+            raise ValueError('{file} is not a packed hack file'.format(file=file_name))
+        if version != VERSION:
+            raise ValueError('unsupported packed format version {version}'.format(version=version))
+        end = HEADER.size + count * 2
+        if len(self.map) < end:
+            raise ValueError('{file} is truncated'.format(file=file_name))
+        view = memoryview(self.map)[HEADER.size:end]
+        if sys.byteorder == 'little':
+            return view.cast(WORD)
+        #big-endian hosts cannot use the mapping directly and pay for one copy
+        words = array(WORD, view.tobytes())
+        words.byteswap()
+        view.release()
+        return words
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, index):
+        return self.words[index]
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''
+        Releases the mapping and closes the file
+        '''
+        if isinstance(self.words, memoryview):
+            self.words.release()
+        self.map.close()
+        self.file.close()
+
+def load_packed(file_name):
+    '''
+    Returns a memory-mapped PackedProgram for the packed file at file_name
+    '''
+    return PackedProgram(file_name)
+
+def read_text(file_name):
+    '''
+    Returns the instruction words stored in a textual .hack file
+    '''
+    with open(file_name, 'r') as file:
+        return [int(line, 2) for line in file if line.strip()]
+
+def write_text(words, file_name):
+    '''
+    Writes the instruction words to file_name in the textual .hack format
+    '''
+    with open(file_name, 'w') as file:
+        for word in words:
+            file.write('{value:016b}\n'.format(value=word))
+
+def text_to_packed(text_name, packed_name):
+    '''
+    Converts the textual .hack file text_name into the packed file packed_name
+    '''
+    words = read_text(text_name)
+    with open(packed_name, 'wb') as file:
+        write_packed(words, file)
+
+def packed_to_text(packed_name, text_name):
+    '''
+    Converts the packed file packed_name into the textual .hack file text_name
+    '''
+    with load_packed(packed_name) as program:
+        write_text(program, text_name)
+
+def parse_args(args):
+    usage = 'Converts between textual .hack files and packed .hackp files'
+    parser = argparse.ArgumentParser(usage=usage)
+
+    #positional arguments
+    parser.add_argument('path',
+        nargs=1,
+        help='the .hack file to pack or the .hackp file to unpack')
+    return parser.parse_args(args)
+
+def main(argv):
+    args = parse_args(argv)
+    path = Path(args.path[0])
+
+    if path.suffix == PACKED:
+        write_name = path.with_suffix(HACK)
+        packed_to_text(path, write_name)
+    else:
+        write_name = path.with_suffix(PACKED)
+        text_to_packed(path, write_name)
+    print('created file {file}'.format(file=write_name))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,10 +2,20 @@ import sys
 import argparse
 from enum import Enum
 from pathlib import Path
+from collections import Counter
 
 COMMENT  = '//'
 NEWLINE = '\n'
 VM = '.vm'
+ROM_SIZE = 32768
+BOOTSTRAP = '(bootstrap)'
+ROUTINES = '(routines)'
+#the function the bootstrap calls, where a whole program starts
+ENTRY_POINT = 'Sys.init'
+#labels of the routines shared by every call site, which no VM label can clash with
+CALL_ROUTINE = 'VM$CALL'
+RETURN_ROUTINE = 'VM$RETURN'
+END_LOOP = 'VM$END'
 
 ADD = 'add'
 SUB = 'sub'
@@ -25,6 +35,20 @@ FUNCTION = 'function'
 RETURN = 'return'
 CALL = 'call'
 
+#the shared routine of every comparison, and the jump it takes when the comparison holds
+COMPARE_ROUTINES = {
+    EQUAL :     ('VM$EQ', 'D;JEQ'),
+    GREATER :   ('VM$GT', 'D;JGT'),
+    LESS :      ('VM$LT', 'D;JLT')
+}
+
+#the jumps of a comparison fused with the if-goto after it, when the result is branched on as is and when negated
+BRANCHES = {
+    EQUAL :     ('D;JEQ', 'D;JNE'),
+    GREATER :   ('D;JGT', 'D;JLE'),
+    LESS :      ('D;JLT', 'D;JGE')
+}
+
 CONSTANT = 'constant'
 LOCAL = 'local'
 ARGUMENT = 'argument'
@@ -38,11 +62,18 @@ SEGMENTS = {
     LOCAL :     '@LCL',
     ARGUMENT :  '@ARG',
     THIS :      '@THIS',
-    THAT :      '@THAT',
-    TEMP :      '@5',
-    POINTER :   '@3'
+    THAT :      '@THAT'
 }
 
+#the base address and size of the segments mapped onto fixed RAM locations
+FIXED_SEGMENTS = {
+    TEMP :      (5, 8),
+    POINTER :   (3, 2)
+}
+
+#the largest index into local, argument, this or that reached by a chain of A=A+1 rather than by adding it
+SHORT_INDEX = 3
+
 class CommandType(Enum):
     ARITHMETIC = 0
     PUSH = 1
@@ -92,6 +123,12 @@ class Parser:
         self.current_line = self.lines[self.next_line].split()
         self.next_line += 1
 
+    def peek(self, count):
+        '''
+        Returns up to count of the commands after the current one, split into their components, without advancing
+        '''
+        return [line.split() for line in self.lines[self.next_line:self.next_line + count]]
+
     def command_type(self):
         '''
         Returns a constant representing the type of the current command
@@ -137,23 +174,152 @@ class Parser:
         '''
         return self.current_line[2]
 
+class Statistics:
+    '''
+    Counts the Hack instructions emitted for each kind of VM command and each VM function
+    '''
+    def __init__(self):
+        self.commands = Counter()
+        self.instructions = Counter()
+        self.functions = Counter()
+
+    def start_command(self, kind):
+        self.commands[kind] += 1
+
+    def record(self, kind, function):
+        self.instructions[kind] += 1
+        self.functions[function] += 1
+
+    def total(self):
+        return sum(self.instructions.values())
+
+    def report(self, top):
+        '''
+        Returns the lines of a report of instructions by command kind, and of the top functions
+        '''
+        total = self.total()
+        lines = ['{kind:<20} {commands:>8} {instructions:>13} {average:>9} {share:>7}'.format(
+            kind='command', commands='commands', instructions='instructions', average='per cmd', share='share')]
+        for kind, instructions in self.instructions.most_common():
+            #the shared routines belong to no command, so they have no average
+            commands = self.commands[kind]
+            lines.append('{kind:<20} {commands:>8} {instructions:>13} {average:>9} {share:>6.1f}%'.format(
+                kind=kind,
+                commands=commands,
+                instructions=instructions,
+                average='{average:.1f}'.format(average=instructions / commands) if commands else '-',
+                share=100 * instructions / total))
+        lines.append('')
+        lines.append('top {count} of {functions} functions by instructions:'.format(count=min(top, len(self.functions)), functions=len(self.functions)))
+        for function, instructions in self.functions.most_common(top):
+            lines.append('{function:<40} {instructions:>8} {share:>6.1f}%'.format(
+                function=function,
+                instructions=instructions,
+                share=100 * instructions / total))
+        lines.append('')
+        lines.append('total {total} instructions, {share:.1f}% of the {rom} word ROM'.format(
+            total=total,
+            share=100 * total / ROM_SIZE,
+            rom=ROM_SIZE))
+        return lines
+
+class CallGraph:
+    '''
+    The functions defined in a set of .vm files, the functions each of them calls, and the number of VM commands in each
+    '''
+    def __init__(self, files):
+        self.calls = {}
+        self.commands = Counter()
+        for file_name in files:
+            parser = Parser(file_name)
+            function = None
+            while parser.has_more_commands():
+                parser.advance()
+                if parser.command_type() == CommandType.FUNCTION:
+                    function = parser.arg1()
+                    self.calls.setdefault(function, set())
+                elif parser.command_type() == CommandType.CALL and function is not None:
+                    self.calls[function].add(parser.arg1())
+                self.commands[function] += 1
+
+    def reachable(self):
+        '''
+        Returns the set of functions reachable by calls from ENTRY_POINT. A program without
+        ENTRY_POINT has no known entry, so all of its functions are reachable.
+        '''
+        if ENTRY_POINT not in self.calls:
+            return set(self.calls)
+        result = set()
+        pending = [ENTRY_POINT]
+        while pending:
+            function = pending.pop()
+            if function in result or function not in self.calls:
+                continue
+            result.add(function)
+            pending.extend(self.calls[function])
+        return result
+
+    def report(self, kept):
+        '''
+        Returns the lines of a report of the functions left out because they are not in kept
+        '''
+        dropped = sorted(set(self.calls) - kept)
+        lines = ['dropped {count} of {functions} functions, {commands} of {total} VM commands, unreachable from {entry}'.format(
+            count=len(dropped),
+            functions=len(self.calls),
+            commands=sum(self.commands[function] for function in dropped),
+            total=sum(self.commands.values()),
+            entry=ENTRY_POINT)]
+        for function in dropped:
+            lines.append('    {function:<40} {commands:>6} commands'.format(function=function, commands=self.commands[function]))
+        undefined = sorted({callee for function in kept for callee in self.calls[function]} - set(self.calls))
+        if undefined:
+            lines.append('called but never defined: {functions}'.format(functions=', '.join(undefined)))
+        return lines
+
 class CodeWriter:
     '''
     Generates the assembly code from parsed VM Commands
     '''
-    def __init__(self, out_file_name):
+    def __init__(self, out_file_name, stats=None, shared_calls=False, shared_compares=False, cache_top=False):
         '''
-        Prepares the output file to write into
+        Prepares the output file to write into, optionally counting the instructions written in stats.
+        With shared_calls, every call and return jumps to one routine written at the end of the file
+        instead of inlining the frame handling, and with shared_compares every eq, gt and lt jumps
+        to one routine per operator. With cache_top, the value on top of the stack is kept in D
+        between commands, and only written to the stack before labels, jumps, calls and returns.
         '''
         self.file = open(out_file_name, 'w')
         self.file_name = None
         self.unique_id = 0
+        self.stats = stats
+        self.shared_calls = shared_calls
+        self.shared_compares = shared_compares
+        self.cache_top = cache_top
+        #is the top of the stack held in D rather than in RAM?
+        self.cached = False
+        #the labels of the shared routines jumped to so far
+        self.routines = set()
+        self.command = None
+        #the function whose code is being written, which stats charge it to
+        self.function = None
+
+    def start_command(self, kind):
+        '''
+        Informs the code writer that the code of a new VM command of the given kind follows
+        '''
+        self.command = kind
+        if self.stats:
+            self.stats.start_command(kind)
 
     def set_file_name(self, file_name):
         '''
         Informs the code writer that the translation of a new VM file is started
         '''
+        self.spill()
         self.file_name = file_name
+        #code before the first function of a file belongs to no function, so it is charged to the file
+        self.function = file_name
 
     def generate_label(self, label):
         '''
@@ -194,7 +360,24 @@ class CodeWriter:
             NOT :       'M=!M'
         }
 
-        if command in [NEG, NOT]:
+        #the results computed in D when the top of the stack is cached
+        CACHED_OPERAND = {
+            ADD :       'D=D+M',
+            SUB :       'D=M-D',
+            NEG :       'D=-D',
+            AND :       'D=D&M',
+            OR :        'D=D|M',
+            NOT :       'D=!D'
+        }
+
+        if command in [NEG, NOT] and self.cached:
+            self.write_line(CACHED_OPERAND[command])
+        elif command in [ADD, SUB, AND, OR] and self.cache_top:
+            self.pop_operand()
+            self.decrement_stack()
+            self.write_line(CACHED_OPERAND[command])
+            self.push_result()
+        elif command in [NEG, NOT]:
             self.decrement_stack()
             self.write_line(OPERAND[command])
             self.increment_stack()
@@ -203,8 +386,18 @@ class CodeWriter:
             self.decrement_stack()
             self.write_line(OPERAND[command])
             self.increment_stack()
+        elif command in [LESS, EQUAL, GREATER] and self.shared_compares:
+            self.spill()
+            routine, _ = COMPARE_ROUTINES[command]
+            self.routines.add(routine)
+            return_label = self.generate_unique_label('{cmd}_RETURN'.format(cmd=command))
+            self.write_line('@{label}'.format(label=return_label))
+            self.write_line('D=A')
+            self.write_line('@{label}'.format(label=routine))
+            self.write_line('0;JMP')
+            self.write_line('({label})'.format(label=return_label))
         elif command in [LESS, EQUAL, GREATER]:
-            self.pop_D_register()
+            self.pop_operand()
             IS_TRUE = self.generate_unique_label('{cmd}_TRUE'.format(cmd=command))
             IS_FALSE = self.generate_unique_label('{cmd}_FALSE'.format(cmd=command))
             DONE = self.generate_unique_label('{cmd}_DONE'.format(cmd=command))
@@ -219,7 +412,7 @@ class CodeWriter:
             self.write_line('({true})'.format(true=IS_TRUE))
             self.write_line('D=-1')
             self.write_line('({done})'.format(done=DONE))
-            self.push_D_register()
+            self.push_result()
         else:
             assert False, 'unsupported arithmetic expression {expr}'.format(expr=command)
 
@@ -237,6 +430,7 @@ class CodeWriter:
         Writes to the output file the assembly code that translates the label command
         '''
         label = self.generate_label(label)
+        self.spill()
         self.write_line('({label})'.format(label=label))
 
     def write_if(self, label):
@@ -244,18 +438,28 @@ class CodeWriter:
         Writes to the output file the assembly code that translates the if-goto command
         '''
         label = self.generate_label(label)
-        self.push(CONSTANT, 0)
-        self.write_arithmetic(EQUAL)
+        self.pop_operand()
+        self.write_line('@{label}'.format(label=label))
+        self.write_line('D;JNE')
+
+    def write_compare_branch(self, command, label, negated):
+        '''
+        Writes to the output file the assembly code of the comparison command followed by if-goto label,
+        with a not in between if negated, as a single conditional jump
+        '''
+        label = self.generate_label(label)
+        self.pop_operand()
         self.decrement_stack()
-        self.write_line('D=M')
+        self.write_line('D=M-D')
         self.write_line('@{label}'.format(label=label))
-        self.write_line('D;JEQ')
+        self.write_line(BRANCHES[command][negated])
 
     def write_goto(self, label):
         '''
         Writes to the output file the assembly code that translates the goto command
         '''
         label = self.generate_label(label)
+        self.spill()
         self.write_line('@{label}'.format(label=label))
         self.write_line('0;JMP')
 
@@ -263,6 +467,9 @@ class CodeWriter:
         '''
         Writes to the output file the assembly code that translates the function command
         '''
+        #a cached top of the stack belongs to the function before
+        self.spill()
+        self.function = function_name
         self.write_line('({label})'.format(label=function_name))
         for _ in range(int(num_locals)):
             self.push(CONSTANT, 0)
@@ -271,6 +478,18 @@ class CodeWriter:
         '''
         Writes to the output file the assembly code that translates the return command
         '''
+        self.spill()
+        if self.shared_calls:
+            self.routines.add(RETURN_ROUTINE)
+            self.write_line('@{label}'.format(label=RETURN_ROUTINE))
+            self.write_line('0;JMP')
+        else:
+            self.write_return_frame()
+
+    def write_return_frame(self):
+        '''
+        Writes the assembly that restores the frame of the caller and jumps back to it
+        '''
         #FRAME = LCL where FRAME is a temp variable
         self.write_line('@LCL')
         self.write_line('D=M')
@@ -327,6 +546,7 @@ class CodeWriter:
         '''
         Writes the assembly that begins the initialization
         '''
+        self.function = BOOTSTRAP
         self.write_line('@256')
         self.write_line('D=A')
         self.write_line('@SP')
@@ -334,7 +554,113 @@ class CodeWriter:
         self.write_call('Sys.init', 0)
 
     def write_call(self, function_name, n_args):
+        '''
+        Writes to the output file the assembly code that translates the call command
+        '''
         return_label = self.generate_unique_label('{name}$return'.format(name=function_name))
+        self.spill()
+        if not self.shared_calls:
+            self.write_call_frame(function_name, n_args, return_label)
+            return
+        self.routines.add(CALL_ROUTINE)
+        #R13 = n+5, R14 = f, D = return address
+        self.write_line('@{num}'.format(num=int(n_args) + 5))
+        self.write_line('D=A')
+        self.write_line('@R13')
+        self.write_line('M=D')
+        self.write_line('@{label}'.format(label=function_name))
+        self.write_line('D=A')
+        self.write_line('@R14')
+        self.write_line('M=D')
+        self.write_line('@{label}'.format(label=return_label))
+        self.write_line('D=A')
+        self.write_line('@{label}'.format(label=CALL_ROUTINE))
+        self.write_line('0;JMP')
+        self.write_line('({label})'.format(label=return_label))
+
+    def write_call_routine(self):
+        '''
+        Writes the routine shared by every call site: it saves the frame of the caller, given the
+        return address in D, n+5 in R13 and the address of the function in R14, and jumps to the function
+        '''
+        self.write_line('({label})'.format(label=CALL_ROUTINE))
+        #push return address
+        self.write_line('@SP')
+        self.write_line('A=M')
+        self.write_line('M=D')
+        #push LCL, ARG, THIS and THAT
+        for segment in [LOCAL, ARGUMENT, THIS, THAT]:
+            self.write_line(SEGMENTS[segment])
+            self.write_line('D=M')
+            self.write_line('@SP')
+            self.write_line('AM=M+1')
+            self.write_line('M=D')
+        self.increment_stack()
+        #arg = SP-n-5
+        self.write_line('@R13')
+        self.write_line('D=M')
+        self.write_line('@SP')
+        self.write_line('D=M-D')
+        self.write_line('@ARG')
+        self.write_line('M=D')
+        #LCL = SP
+        self.write_line('@SP')
+        self.write_line('D=M')
+        self.write_line('@LCL')
+        self.write_line('M=D')
+        #goto f
+        self.write_line('@R14')
+        self.write_line('A=M')
+        self.write_line('0;JMP')
+
+    def write_compare_routine(self, command):
+        '''
+        Writes the routine shared by every site of the comparison command: it replaces the
+        top two values of the stack by true or false and returns to the address given in D
+        '''
+        routine, jump = COMPARE_ROUTINES[command]
+        done = '{routine}$DONE'.format(routine=routine)
+        self.write_line('({label})'.format(label=routine))
+        self.write_line('@R15')
+        self.write_line('M=D')
+        self.pop_D_register()
+        self.write_line('A=A-1')
+        self.write_line('D=M-D')
+        #assume true, and overwrite with false unless the jump is taken
+        self.write_line('M=-1')
+        self.write_line('@{label}'.format(label=done))
+        self.write_line(jump)
+        self.write_line('@SP')
+        self.write_line('A=M-1')
+        self.write_line('M=0')
+        self.write_line('({label})'.format(label=done))
+        self.write_line('@R15')
+        self.write_line('A=M')
+        self.write_line('0;JMP')
+
+    def write_routines(self):
+        '''
+        Writes the shared routines jumped to, behind a loop that stops execution
+        from running into them at the end of the program
+        '''
+        self.command = ROUTINES
+        self.function = ROUTINES
+        self.write_line('({label})'.format(label=END_LOOP))
+        self.write_line('@{label}'.format(label=END_LOOP))
+        self.write_line('0;JMP')
+        if CALL_ROUTINE in self.routines:
+            self.write_call_routine()
+        if RETURN_ROUTINE in self.routines:
+            self.write_line('({label})'.format(label=RETURN_ROUTINE))
+            self.write_return_frame()
+        for command, (routine, _) in COMPARE_ROUTINES.items():
+            if routine in self.routines:
+                self.write_compare_routine(command)
+
+    def write_call_frame(self, function_name, n_args, return_label):
+        '''
+        Writes the assembly that saves the frame of the caller inline and jumps to the function
+        '''
         #push return address
         self.write_line('@{label}'.format(label=return_label))
         self.write_line('D=A')
@@ -376,65 +702,76 @@ class CodeWriter:
         self.write_line('({label})'.format(label=return_label))
 
     def push(self, segment, index):
+        self.spill()
         if segment == CONSTANT:
             self.write_line('@{index}'.format(index=index))
             self.write_line('D=A')
-            self.push_D_register()
-        elif segment in [LOCAL, ARGUMENT, THIS, THAT]:
-            self.calculate_address(segment, index)
+            self.push_result()
+        elif segment in SEGMENTS:
+            self.point_at(segment, index)
             self.write_line('D=M')
-            self.push_D_register()
-        elif segment in [TEMP, POINTER]:
-            self.calculate_offset(segment, index)
+            self.push_result()
+        elif segment in FIXED_SEGMENTS or segment == STATIC:
+            self.write_line('@{address}'.format(address=self.fixed_address(segment, index)))
             self.write_line('D=M')
-            self.push_D_register()
-        elif segment == STATIC:
-            label = self.static_label(index)
-            self.write_line('@{label}'.format(label=label))
-            self.write_line('D=M')
-            self.push_D_register()
+            self.push_result()
         else:
             assert False, 'unsupported segment {segment}'.format(segment=segment)
 
     def pop(self, segment, index):
-        if segment in [LOCAL, ARGUMENT, THIS, THAT]:
-            self.calculate_address(segment, index)
-            self.store_at_address()
-        elif segment in [TEMP, POINTER]:
-            self.calculate_offset(segment, index)
-            self.store_at_address()
-        elif segment == STATIC:
-            label = self.static_label(index)
-            self.write_line('@{label}'.format(label=label))
-            self.write_line('D=A')
-            self.store_at_address()
+        if segment in SEGMENTS and int(index) <= SHORT_INDEX:
+            self.pop_operand()
+            self.point_at(segment, index)
+            self.write_line('M=D')
+        elif segment in SEGMENTS:
+            #D = address + value, so both can be recovered once the value is read, without a temp variable
+            self.spill()
+            self.write_line(SEGMENTS[segment])
+            self.write_line('D=M')
+            self.write_line('@{index}'.format(index=index))
+            self.write_line('D=D+A')
+            self.decrement_stack()
+            self.write_line('D=D+M')
+            self.write_line('A=D-M')
+            self.write_line('M=D-A')
+        elif segment in FIXED_SEGMENTS or segment == STATIC:
+            self.pop_operand()
+            self.write_line('@{address}'.format(address=self.fixed_address(segment, index)))
+            self.write_line('M=D')
         else:
             assert False, 'unsupported segment {segment}'.format(segment=segment)
 
-    def store_at_address(self):
-        self.write_line('@R13')
-        self.write_line('M=D')
-        self.decrement_stack()
-        self.write_line('D=M')
-        self.write_line('@R13')
-        self.write_line('A=M')
-        self.write_line('M=D')
-
-    def calculate_address(self, segment, index):
-        self.write_line(SEGMENTS[segment])
-        self.write_line('A=M')
-        self.add_by_index(index)
+    def fixed_address(self, segment, index):
+        '''
+        returns the address of a temp or pointer entry, or the label of a static variable, which are known when translating
+        '''
+        if segment == STATIC:
+            return self.static_label(index)
+        base, size = FIXED_SEGMENTS[segment]
+        assert 0 <= int(index) < size, '{segment} {index} is out of range'.format(segment=segment, index=index)
+        return base + int(index)
 
-    def calculate_offset(self, segment, index):
+    def point_at(self, segment, index):
+        '''
+        Writes the assembly that sets A to the address of entry index of local, argument, this or that, leaving D as it is
+        for the indexes up to SHORT_INDEX
+        '''
+        index = int(index)
         self.write_line(SEGMENTS[segment])
-        self.add_by_index(index)
-
-    def add_by_index(self, index):
-        self.write_line('D=A')
-        self.write_line('@{index}'.format(index=index))
-        self.write_line('AD=D+A')
+        if index == 0:
+            self.write_line('A=M')
+        elif index <= SHORT_INDEX:
+            self.write_line('A=M+1')
+            for _ in range(index - 1):
+                self.write_line('A=A+1')
+        else:
+            self.write_line('D=M')
+            self.write_line('@{index}'.format(index=index))
+            self.write_line('A=D+A')
 
     def write_line(self, line):
+        if self.stats and not line.startswith('('):
+            self.stats.record(self.command, self.function)
         self.file.write(line)
         self.file.write(NEWLINE)
 
@@ -456,15 +793,86 @@ class CodeWriter:
         self.write_line('M=D')
         self.increment_stack()
 
+    def push_result(self):
+        '''
+        Pushes D onto the stack, or only marks it as the cached top of the stack when caching
+        '''
+        if self.cache_top:
+            self.cached = True
+        else:
+            self.push_D_register()
+
+    def pop_operand(self):
+        '''
+        Pops the top of the stack into D, where it already is when cached
+        '''
+        if self.cached:
+            self.cached = False
+        else:
+            self.pop_D_register()
+
+    def spill(self):
+        '''
+        Writes a top of the stack cached in D to the stack
+        '''
+        if self.cached:
+            self.write_line('@SP')
+            self.write_line('AM=M+1')
+            self.write_line('A=A-1')
+            self.write_line('M=D')
+            self.cached = False
+
     def close(self):
         '''
-        Closes the output file
+        Writes any shared routines and closes the output file
         '''
+        self.spill()
+        if self.routines:
+            self.write_routines()
         self.file.close()
 
-def translate(parser, writer):
+def command_kind(parser):
+    '''
+    Returns the kind of the current command for statistics: the command, with the segment for push and pop
+    '''
+    if parser.command_type() in [CommandType.PUSH, CommandType.POP]:
+        return '{command} {segment}'.format(command=parser.current_line[0], segment=parser.arg1())
+    return parser.current_line[0]
+
+def fused_branch(parser):
+    '''
+    Returns the commands that follow the current comparison and form one compare and branch with it:
+    [if-goto] or [not, if-goto]. Returns an empty list when there are none.
+    '''
+    if parser.command_type() != CommandType.ARITHMETIC or parser.arg1() not in BRANCHES:
+        return []
+    following = parser.peek(2)
+    if following and following[0][0] == IF_GOTO:
+        return following[:1]
+    if len(following) == 2 and following[0] == [NOT] and following[1][0] == IF_GOTO:
+        return following
+    return []
+
+def translate(parser, writer, functions=None):
+    '''
+    Translates every command of the parser, leaving out the functions not in functions when given
+    '''
+    keep = True
     while parser.has_more_commands():
         parser.advance()
+        if functions is not None and parser.command_type() == CommandType.FUNCTION:
+            keep = parser.arg1() in functions
+        if not keep:
+            continue
+        fused = fused_branch(parser)
+        if fused:
+            writer.start_command(' '.join([parser.arg1()] + [command[0] for command in fused]))
+            command = parser.arg1()
+            for _ in fused:
+                parser.advance()
+            writer.write_compare_branch(command, parser.arg1(), len(fused) == 2)
+            continue
+        writer.start_command(command_kind(parser))
         if parser.command_type() == CommandType.ARITHMETIC:
             writer.write_arithmetic(parser.arg1())
         elif parser.command_type() in [CommandType.PUSH, CommandType.POP]:
@@ -499,21 +907,46 @@ def parse_args(args):
         default=True,
         action='store_false',
         help='translate without bootstrap instructions')
+    parser.add_argument('-c', '--shared-calls',
+        default=False,
+        action='store_true',
+        help='jump to one shared routine for every call and return instead of inlining them')
+    parser.add_argument('-e', '--shared-compares',
+        default=False,
+        action='store_true',
+        help='jump to one shared routine per operator for every eq, gt and lt instead of inlining them')
+    parser.add_argument('-d', '--cache-top',
+        default=False,
+        action='store_true',
+        help='keep the top of the stack in D between commands instead of writing it to the stack after each one')
+    parser.add_argument('-w', '--whole-program',
+        default=False,
+        action='store_true',
+        help='only translate the functions reachable by calls from {entry}, and report the others'.format(entry=ENTRY_POINT))
+    parser.add_argument('-s', '--stats',
+        default=False,
+        action='store_true',
+        help='report the instructions emitted per VM command kind and per function')
+    parser.add_argument('-t', '--top',
+        default=10,
+        type=int,
+        help='the number of functions listed by --stats')
     return parser.parse_args(args)
 
 def get_write_path(parent, name):
     return parent.joinpath('{name}.asm'.format(name=name))
 
-def translate_files(files, write_name, bootstrap):
-    writer = CodeWriter(write_name)
+def translate_files(files, write_name, bootstrap, stats=None, shared_calls=False, shared_compares=False, cache_top=False, functions=None):
+    writer = CodeWriter(write_name, stats, shared_calls, shared_compares, cache_top)
     if bootstrap:
         writer.set_file_name('Sys')
+        writer.start_command('bootstrap')
         writer.write_init()
     for file_name in files:
         print('Parsing {file}'.format(file=file_name))
         parser=Parser(file_name)
         writer.set_file_name(file_name.stem)
-        translate(parser, writer)
+        translate(parser, writer, functions)
     writer.close()
 
 def main(argv):
@@ -532,8 +965,15 @@ def main(argv):
                 files.append(file_name)
         write_name = get_write_path(path, path.name)
 
-    translate_files(files, write_name, args.bootstrap)
+    stats = Statistics() if args.stats else None
+    graph = CallGraph(files) if args.whole_program else None
+    functions = graph.reachable() if graph else None
+    translate_files(files, write_name, args.bootstrap, stats, args.shared_calls, args.shared_compares, args.cache_top, functions)
     print('Successfully translated {files} to {output}'.format(files=files, output=write_name))
+    if graph:
+        print(NEWLINE.join(graph.report(functions)))
+    if stats:
+        print(NEWLINE.join(stats.report(args.top)))
 
 if __name__ == '__main__':
     main(sys.argv[1:])
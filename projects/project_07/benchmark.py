@@ -0,0 +1,142 @@
+import io
+import re
+import sys
+import shutil
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+
+import VMTranslator
+
+PROJECTS = Path(__file__).resolve().parent.parent
+sys.path.append(str(PROJECTS.joinpath('project_06')))
+import Assembler
+from emulator import Emulator
+
+'''
+Measures the code VMTranslator generates in each of its modes on the VM programs of
+project_07 and project_08. Every program is translated, assembled and run on the
+emulator of project_06 with the RAM settings of its .tst script, and the RAM locations
+the script outputs are checked against its .cmp file. For each mode the size of the
+program in ROM words and the number of instructions executed are reported.
+
+A program is run until it reaches a final @Xxx 0;JMP loop, such as the one Sys.init
+ends with, or runs off the end of its code, but never for more cycles than its test
+script runs the CPU emulator for.
+'''
+
+TST = '.tst'
+CMP = '.cmp'
+#appended to every program so running off the end of the code stops the emulator
+END_LOOP = ['(VM$BENCHMARK$END)', '@VM$BENCHMARK$END', '0;JMP']
+
+#the VMTranslator options of every mode
+MODES = {
+    'inline' : [],
+    'shared-calls' : ['--shared-calls'],
+    'shared-compares' : ['--shared-compares'],
+    'shared' : ['--shared-calls', '--shared-compares'],
+    'cache-top' : ['--cache-top'],
+    'whole-program' : ['--whole-program'],
+    'all' : ['--shared-calls', '--shared-compares', '--cache-top', '--whole-program']
+}
+
+def find_tests(root=PROJECTS):
+    '''
+    Returns the .tst scripts of the VM programs, leaving out the VM emulator scripts
+    '''
+    scripts = sorted(Path(root).glob('project_0[78]/*/*/*' + TST))
+    return [path for path in scripts if not path.stem.endswith('VME')]
+
+def read_script(path):
+    '''
+    Returns ([(address, value)] set before running, cycles run, [addresses output]) of a .tst script
+    '''
+    text = re.sub(r'//.*', '', path.read_text())
+    sets = [(int(address), int(value)) for address, value in re.findall(r'set\s+RAM\[(\d+)\]\s+(-?\d+)', text)]
+    cycles = sum(int(count) for count in re.findall(r'repeat\s+(\d+)', text))
+    outputs = [int(address) for address in re.findall(r'RAM\[(\d+)\]', ' '.join(re.findall(r'output-list([^;]*);', text)))]
+    return sets, cycles, outputs
+
+def read_compare(path):
+    '''
+    Returns the numbers in the rows of a .cmp file
+    '''
+    values = []
+    for line in path.read_text().splitlines():
+        cells = [cell.strip() for cell in line.strip().strip('|').split('|')]
+        if all(re.fullmatch(r'-?\d+', cell) for cell in cells):
+            values.extend(int(cell) for cell in cells)
+    return values
+
+def translate(directory, options, bootstrap):
+    '''
+    Translates the .vm files of directory with the given VMTranslator options and returns the assembly lines
+    '''
+    with tempfile.TemporaryDirectory() as work:
+        work = Path(work).joinpath(directory.name)
+        work.mkdir()
+        for file_name in directory.glob('*' + VMTranslator.VM):
+            shutil.copy(file_name, work)
+        argv = [str(work)] + options + ([] if bootstrap else ['--no_bootstrap'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            VMTranslator.main(argv)
+        return VMTranslator.get_write_path(work, work.name).read_text().splitlines()
+
+def measure(script, options):
+    '''
+    Returns (ROM words, cycles executed, passed) of the program of a test script translated with options
+    '''
+    sets, cycles, outputs = read_script(script)
+    #the scripts that set up the frame pointers themselves test code without the bootstrap
+    bootstrap = script.parent.joinpath('Sys' + VMTranslator.VM).exists() and not any(address == 1 for address, _ in sets)
+    words = Assembler.assemble(translate(script.parent, options, bootstrap) + END_LOOP)
+    emulator = Emulator(words)
+    for address, value in sets:
+        emulator.poke(address, value)
+    executed = emulator.run_until_halt(cycles)
+    passed = [emulator.peek(address) for address in outputs] == read_compare(script.with_suffix(CMP))
+    return len(words) - len(END_LOOP) + 1, executed, passed
+
+def parse_args(args):
+    usage = 'Reports the ROM size and cycles of the VM test programs translated in each VMTranslator mode'
+    parser = argparse.ArgumentParser(usage=usage)
+
+    #optional arguments
+    parser.add_argument('-m', '--mode',
+        dest='modes',
+        default=[],
+        action='append',
+        choices=list(MODES),
+        help='a mode to measure; may be repeated, and defaults to every mode')
+    parser.add_argument('-k', '--filter',
+        default=None,
+        help='only measure programs whose path contains this text')
+    return parser.parse_args(args)
+
+def main(argv):
+    args = parse_args(argv)
+    modes = args.modes or list(MODES)
+    scripts = [script for script in find_tests() if not args.filter or args.filter in str(script)]
+
+    print('{program:<18}'.format(program='program') + ''.join('{mode:>26}'.format(mode=mode) for mode in modes))
+    print('{program:<18}'.format(program='') + ''.join('{words:>16}{cycles:>10}'.format(words='words', cycles='cycles') for _ in modes))
+    totals = {mode : [0, 0] for mode in modes}
+    failed = False
+    for script in scripts:
+        row = '{program:<18}'.format(program=script.stem)
+        for mode in modes:
+            words, cycles, passed = measure(script, MODES[mode])
+            totals[mode][0] += words
+            totals[mode][1] += cycles
+            failed = failed or not passed
+            row += '{words:>16}{cycles:>9}{status}'.format(words=words, cycles=cycles, status=' ' if passed else '!')
+        print(row)
+    print('{program:<18}'.format(program='total') + ''.join('{words:>16}{cycles:>9} '.format(words=words, cycles=cycles) for words, cycles in totals.values()))
+    if failed:
+        print('! marks programs whose RAM does not match their .cmp file')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])